@@ -0,0 +1,306 @@
+"""Benchmarks of the scanning and lookup hot paths of ipython-suggestions.
+
+Builds a synthetic sys.path tree, scans it, and times symbol searches,
+%findsymbol completions, AttributeError suggestions and
+`super_greedy_complete`. Results are written as JSON, so runs can be compared
+to track regressions:
+
+    python benchmark.py --files 2000 --symbols 40 --depth 3 -o bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import string
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+import ipython_suggestions
+from super_greedy_complete import super_greedy_complete
+
+_syllables = [
+    "get", "set", "load", "dump", "parse", "read", "write", "open", "close",
+    "index", "array", "frame", "table", "model", "query", "config", "cache",
+    "path", "file", "node", "tree", "graph", "image", "token", "stream",
+    "buffer", "client", "server", "handler", "request", "response", "error",
+]
+
+
+class _Event(object):
+    def __init__(self, line, symbol=None):
+        self.line = line
+        self.text_until_cursor = line
+        self.symbol = line.split()[-1] if symbol is None else symbol
+
+
+class _Shell(object):
+    def __init__(self, user_ns):
+        self.user_ns = user_ns
+
+
+def _make_name(rng, kind):
+    words = [rng.choice(_syllables) for _ in range(rng.randint(1, 3))]
+    if kind == "class":
+        return "".join(w.capitalize() for w in words)
+    if kind == "var":
+        return "_".join(words).upper()
+    return "_".join(words)
+
+
+def make_tree(root, files, symbols, depth, seed=0):
+    """Write `files` modules of `symbols` symbols each under `root`.
+
+    Modules are spread over packages nested `depth` levels deep. Returns
+    the number of source bytes written.
+    """
+    rng = random.Random(seed)
+    packages = [""]
+    nbytes = 0
+    for n in range(files):
+        if n % 10 == 0:
+            parent = rng.choice(packages)
+            if parent.count(os.sep) + 1 >= depth:
+                parent = ""
+            package = os.path.join(parent, "pkg%d" % len(packages))
+            os.makedirs(os.path.join(root, package))
+            with open(os.path.join(root, package, "__init__.py"), "w") as f:
+                f.write("")
+            packages.append(package)
+
+        lines = ['"""Synthetic module %d."""' % n, "import os", ""]
+        for _ in range(symbols):
+            kind = rng.choice(("class", "def", "def", "var"))
+            name = _make_name(rng, kind)
+            if kind == "class":
+                lines += ["class %s(object):" % name, "    x = 1", ""]
+            elif kind == "def":
+                lines += ["def %s(a, b=None):" % name, "    return a", ""]
+            else:
+                lines += ["%s = %d" % (name, rng.randint(0, 1000)), ""]
+        source = "\n".join(lines)
+        nbytes += len(source)
+        with open(os.path.join(root, package, "mod%d.py" % n), "w") as f:
+            f.write(source)
+    return nbytes
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on linux, bytes on macOS.
+    return rss / 1e6 if sys.platform == "darwin" else rss / 1e3
+
+
+def _latencies(func, args_list, repeat=1):
+    """Return latency statistics of calling `func` with each of `args_list`."""
+    times = []
+    for args in args_list:
+        for _ in range(repeat):
+            t = time.perf_counter()
+            func(*args)
+            times.append(time.perf_counter() - t)
+    times.sort()
+    return {
+        "calls": len(times),
+        "mean_us": 1e6 * sum(times) / len(times),
+        "p50_us": 1e6 * times[len(times) // 2],
+        "p95_us": 1e6 * times[int(len(times) * 0.95)],
+        "max_us": 1e6 * times[-1],
+    }
+
+
+def bench_scan(root, nfiles, nbytes, cache_dir):
+    """Time a cold scan without cache, then a warm scan with one."""
+    results = {}
+    sys.path[:] = [root]
+    for name, directory in (("cold", ""), ("warm", cache_dir)):
+        ipython_suggestions._cache_dir = directory
+        if directory:
+            # Populate the cache, so that the timed scan is warm.
+            ipython_suggestions.inspect_all_objs()
+        rss_before = _peak_rss_mb()
+        t = time.perf_counter()
+        ipython_suggestions.inspect_all_objs()
+        elapsed = time.perf_counter() - t
+        if ipython_suggestions._symbols_error:
+            raise RuntimeError("the scan failed")
+        results[name] = {
+            "seconds": elapsed,
+            "files_per_second": nfiles / elapsed,
+            "megabytes_per_second": nbytes / elapsed / 1e6,
+            "symbols": len(ipython_suggestions._symbols),
+            "peak_rss_mb_before": rss_before,
+            "peak_rss_mb": _peak_rss_mb(),
+        }
+    return results
+
+
+def _typo(rng, word):
+    i = rng.randrange(len(word))
+    op = rng.choice(("delete", "insert", "substitute", "transpose"))
+    if op == "delete":
+        return word[:i] + word[i + 1 :]
+    if op == "insert":
+        return word[:i] + rng.choice(string.ascii_lowercase) + word[i:]
+    if op == "substitute":
+        return word[:i] + rng.choice(string.ascii_lowercase) + word[i + 1 :]
+    i = min(i, len(word) - 2)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2 :]
+
+
+def bench_close_cached_symbol(queries, seed=0):
+    rng = random.Random(seed)
+    names = [
+        name
+        for name in ipython_suggestions._symbols.names
+        if len(name) >= 4 and name.isidentifier()
+    ]
+    words = [rng.choice(names) for _ in range(queries)]
+    typos = [_typo(rng, word) for word in words]
+    func = ipython_suggestions.close_cached_symbol
+    return {
+        "exact": _latencies(func, [(w, True) for w in words]),
+        "fuzzy": _latencies(func, [(w, False) for w in typos]),
+        "distance_2": _latencies(
+            func, [(w, False, 2) for w in typos[: max(1, queries // 10)]]
+        ),
+    }
+
+
+def bench_suggest_prefix(queries, max_length=5, seed=0):
+    rng = random.Random(seed)
+    names = [n for n in ipython_suggestions._symbols.names if len(n) >= max_length]
+    results = {}
+    for length in range(1, max_length + 1):
+        events = [
+            (None, _Event("%findsymbol " + rng.choice(names)[:length]))
+            for _ in range(queries)
+        ]
+        results[str(length)] = _latencies(ipython_suggestions.suggest_prefix, events)
+    return results
+
+
+def _make_class(rng, methods):
+    namespace = dict((_make_name(rng, "def"), lambda self: None) for _ in range(methods))
+    return type("Synthetic", (object,), namespace)
+
+
+def bench_suggest_attr(queries, methods=500, seed=0):
+    """Time suggestions for a repeated AttributeError on a few kinds of objects."""
+    rng = random.Random(seed)
+    cls = _make_class(rng, methods)
+    with_dict = cls()
+    for _ in range(50):
+        setattr(with_dict, _make_name(rng, "var").lower(), 0)
+    user_ns = {"plain": cls(), "with_dict": with_dict, "module": os}
+    results = {}
+    with open(os.devnull, "w") as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            for varname in sorted(user_ns):
+                attr = _typo(rng, rng.choice(dir(user_ns[varname])).strip("_") or "x")
+                source = "%s.%s()" % (varname, attr)
+                value = "'%s' object has no attribute '%s'" % (
+                    type(user_ns[varname]).__name__,
+                    attr,
+                )
+                results[varname] = _latencies(
+                    ipython_suggestions.suggest_attr,
+                    [(user_ns, source, value)],
+                    queries,
+                )
+        finally:
+            sys.stdout = stdout
+    return results
+
+
+def bench_super_greedy_complete(repeat, tmpdir):
+    user_ns = {
+        "os": os,
+        "json": json,
+        "small": dict(("key%d" % i, i) for i in range(10)),
+        "big": dict(("key%d" % i, i) for i in range(100000)),
+        "text": "some text",
+        "values": list(range(1000)),
+    }
+    shell = _Shell(user_ns)
+    lines = [
+        "os.pa",
+        "os.path.jo",
+        "json.lo",
+        "text.st",
+        "values.",
+        "small['",
+        "big['key1",
+        "open('{tmpdir}/",
+        "x = os.getcwd().st",
+        "f(a, b)[0].",
+    ]
+    results = {}
+    for line in lines:
+        event = _Event(line.format(tmpdir=tmpdir))
+        results[line] = _latencies(super_greedy_complete, [(shell, event)], repeat)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=1000, help="Number of modules.")
+    parser.add_argument(
+        "--symbols", type=int, default=40, help="Number of symbols per module."
+    )
+    parser.add_argument("--depth", type=int, default=3, help="Package nesting depth.")
+    parser.add_argument(
+        "--queries", type=int, default=200, help="Number of queries per benchmark."
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "-o", "--output", default="-", help="File to write the JSON results to."
+    )
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp(prefix="ipython-suggestions-bench-")
+    syspath = list(sys.path)
+    try:
+        root = os.path.join(tmpdir, "site")
+        os.makedirs(root)
+        nbytes = make_tree(root, args.files, args.symbols, args.depth, args.seed)
+        results = {
+            "scan": bench_scan(root, args.files, nbytes, os.path.join(tmpdir, "cache")),
+            "close_cached_symbol": bench_close_cached_symbol(args.queries, args.seed),
+            "suggest_prefix": bench_suggest_prefix(args.queries, seed=args.seed),
+            "suggest_attr": bench_suggest_attr(args.queries, seed=args.seed),
+            "super_greedy_complete": bench_super_greedy_complete(
+                max(1, args.queries // 20), root
+            ),
+        }
+    finally:
+        sys.path[:] = syspath
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    report = {
+        "params": vars(args),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,34 +4,195 @@ To activate, pip-install and append the output of `ipython -m ipython_suggestion
 to `~/.ipython/profile_default/ipython_config.py`.
 """
 
-from __future__ import print_function
 import builtins
 import os
 import sys
 import re
 import traceback
 import string
+import subprocess
 import itertools
 import bisect
-from collections import defaultdict
+import fnmatch
+import errno
+import select
+import time
+import heapq
+import hashlib
+import functools
+import json
+import pickle
+import multiprocessing
+import mmap
+import pathlib
+import struct
+import sysconfig
+import weakref
+import zlib
+from collections import Counter, defaultdict, deque
+from collections.abc import Sequence
 from threading import Thread
 from inspect import isclass
+from sys import intern
+from array import array
 
 from IPython import get_ipython
 from IPython.core.magic import register_line_magic
 from IPython.core.magic_arguments import argument, magic_arguments, parse_argstring
 
-from super_greedy_complete import super_greedy_complete
+from super_greedy_complete import (
+    AsyncCompleter,
+    super_greedy_complete,
+    clear_completion_caches,
+)
 
 _var_name_chars = string.ascii_letters + string.digits + "_."
 _builtins = set(dir(builtins))
-
-_symbols_cache = defaultdict(lambda: defaultdict(dict))
-_symbols_sorted = None
+_builtins_index = None
+# Index of the names in the user namespace, built on the first NameError and
+# brought up to date on each later one.
+_user_ns_index = None
+# Indexes of the attributes of classes whose instances raised AttributeError.
+_type_indexes = weakref.WeakKeyDictionary()
+
+_symbols = None
+_symbols_deletes = None
+_symbols_overlay = None
+_symbols_progress = None
 _symbols_running = False
 _symbols_error = False
 _symbols_last = None
 
+# Per-file symbol tables are persisted here, so that on startup only new or
+# changed files are parsed again. Set the variable to an empty string to
+# disable the on-disk cache.
+_cache_dir = os.environ.get(
+    "IPYTHON_SUGGESTIONS_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "ipython-suggestions"),
+)
+_cache_version = 2
+
+# Number of processes that parse source files, 0 means one per CPU.
+_scan_workers = int(os.environ.get("IPYTHON_SUGGESTIONS_WORKERS", "1"))
+_scan_chunksize = 64
+
+# With "process", symbols are scanned in a child process with a lower
+# priority, so that the scan does not compete with the kernel for the GIL.
+_scanner = os.environ.get("IPYTHON_SUGGESTIONS_SCANNER", "thread")
+_scanner_nice = 10
+_scanner_settings = (
+    "_cache_dir",
+    "_scan_workers",
+    "_exclude",
+    "_include",
+    "_packages_only",
+    "_watch",
+    "_history_file",
+)
+
+# Maximal number of completions offered for a %findsymbol prefix, 0 for all.
+_completion_limit = int(os.environ.get("IPYTHON_SUGGESTIONS_COMPLETION_LIMIT", "100"))
+_test_packages = frozenset(["test", "tests", "testing"])
+
+# With "kernel", completion hooks run in a worker thread in Jupyter kernels,
+# so that a slow completion holds the shell channel for at most
+# `_complete_deadline` seconds. "1" does so in every shell, "0" in none. It is
+# off by default, as completions then evaluate expressions out of the shell's
+# thread.
+_async_complete = os.environ.get("IPYTHON_SUGGESTIONS_ASYNC_COMPLETE", "0")
+_complete_deadline = float(
+    os.environ.get("IPYTHON_SUGGESTIONS_COMPLETE_DEADLINE", "0.2")
+)
+_completer = None
+
+# Glob patterns of the names (or, with a path separator, of the full paths)
+# of directories and files that are not scanned, unless they match an include
+# pattern too. With `_packages_only`, the scan only descends into directories
+# that can be imported as packages.
+_exclude = os.environ.get(
+    "IPYTHON_SUGGESTIONS_EXCLUDE",
+    os.pathsep.join([".*", "__pycache__", "node_modules"]),
+)
+_exclude = [pattern for pattern in _exclude.split(os.pathsep) if pattern]
+_include = os.environ.get("IPYTHON_SUGGESTIONS_INCLUDE", "")
+_include = [pattern for pattern in _include.split(os.pathsep) if pattern]
+_packages_only = os.environ.get("IPYTHON_SUGGESTIONS_PACKAGES_ONLY", "") not in (
+    "",
+    "0",
+)
+_identifier = re.compile(r"^[_A-Za-z][_A-Za-z0-9]*$")
+
+# On Linux, watch the scanned directories with inotify and re-index source
+# files that change, once no changes came for `_watch_delay` seconds.
+_watch = os.environ.get("IPYTHON_SUGGESTIONS_WATCH", "") not in ("", "0")
+_watch_delay = 1.0
+_watcher = None
+
+# While `profile_scan` runs, maps each scanned directory to the
+# ``[seconds, files, bytes]`` spent on it and on its own files.
+_profile = None
+
+# Ranking of the symbols found by %findsymbol, of which `_findsymbol_limit` are
+# shown at a time. Modules under the standard library directories, other than
+# site packages, rank before third party ones.
+_findsymbol_limit = 20
+_kind_ranks = {"module": 0, "class": 1, "def": 1, "var": 2}
+_kind_tags = {"class": "C", "def": "F", "var": "V"}
+_stdlib_dirs = tuple(
+    set(
+        os.path.join(os.path.abspath(sysconfig.get_paths()[key]), "")
+        for key in ("stdlib", "platstdlib")
+    )
+)
+_site_dirs = ("site-packages", "dist-packages")
+
+# Top-level classes, functions and variables, found in whole files at once.
+_symbol_re = re.compile(
+    br"^(?:(class|def) ([_A-z][_A-z0-9]*)[\(:]|([A-z][_A-z0-9]+)[^\S\n]=)",
+    re.MULTILINE,
+)
+# Absolute import statements, counted to rank symbols by how often they are
+# imported. With `_history`, the imports in the IPython history database are
+# counted too, as of the last time the index was built.
+_import_re = re.compile(
+    br"^[ \t]*(?:from[ \t]+([A-Za-z_][\w.]*)[ \t]+import[ \t]*(\([^)]*\)|[^\n#;]*)"
+    br"|import[ \t]+([^\n#;]*))",
+    re.MULTILINE,
+)
+_dotted_name = re.compile(br"^[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)*$")
+_history = os.environ.get("IPYTHON_SUGGESTIONS_HISTORY", "") not in ("", "0")
+_history_file = None
+
+# Counters of the last scan, and latencies of the last `_stats_window` calls of
+# each query function, for %suggestions_stats and `get_suggestions_stats`.
+_stats_window = 1000
+_scan_stats = None
+_latencies = defaultdict(lambda: deque(maxlen=_stats_window))
+_calls = Counter()
+_timed_names = (
+    "close_cached_symbol",
+    "suggest_prefix",
+    "suggest_name",
+    "suggest_attr",
+    "super_greedy_complete",
+)
+
+
+def _timed(func):
+    """Wrap `func` to record the latency of each call in `_latencies`."""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _latencies[name].append(time.perf_counter() - start)
+            _calls[name] += 1
+
+    return timed
+
 
 def on_exception(ipython, etype, value, tb, tb_offset=None):
     ipython.showtraceback()
@@ -43,19 +204,43 @@ def on_exception(ipython, etype, value, tb, tb_offset=None):
         suggest_attr(ipython.user_ns, source, str(value))
 
 
+@_timed
 def suggest_prefix(self, event):
-    global _symbols_cache, _symbols_sorted
-    ret = []
     key = event.symbol.split("...")[0]
-    if _symbols_sorted is not None and key:
-        i = bisect.bisect_left(_symbols_sorted, key)
-        j = bisect.bisect_right(_symbols_sorted, key[:-1] + chr(ord(key[-1]) + 1))
-        for word in _symbols_sorted[i:j]:
-            for _, modulepath in _symbols_cache[len(word)][word]:
-                ret.append("%s...%s" % (word, modulepath))
-    return sorted(ret)
+    symbols = _symbols
+    if symbols is None or not key:
+        return []
+    overlay = _symbols_overlay
+    if overlay is None or overlay.base is not symbols:
+        best = symbols.ranked_prefix(key, _completion_limit)
+        return ["%s...%s" % (word, modulepath) for _, word, modulepath in best]
+
+    # A module of the working directory may shadow one of the index.
+    best = unique(
+        "%s...%s" % (word, modulepath)
+        for _, word, modulepath in heapq.merge(
+            symbols.ranked_prefix(key, _completion_limit, overlay.hidden),
+            overlay.ranked_prefix(key, _completion_limit),
+        )
+    )
+    if _completion_limit:
+        best = itertools.islice(best, _completion_limit)
+    return list(best)
 
 
+def _namespace_index(user_ns):
+    global _user_ns_index, _builtins_index
+    if _builtins_index is None:
+        _builtins_index = DeletionIndex(_builtins)
+    if _user_ns_index is None or _user_ns_index.namespace is not user_ns:
+        _user_ns_index = NamespaceIndex(user_ns)
+    else:
+        # Names defined since the last error, including by the failing cell.
+        _user_ns_index.update()
+    return _user_ns_index
+
+
+@_timed
 def suggest_name(user_ns, source, value):
     global _symbols_error, _symbols_running, _symbols_last
 
@@ -70,7 +255,10 @@ def suggest_name(user_ns, source, value):
 
     suggestions = list(
         unique(
-            itertools.chain(close_words(attr, user_ns), close_words(attr, _builtins))
+            itertools.chain(
+                _namespace_index(user_ns).close_words(attr),
+                _builtins_index.close_words(attr),
+            )
         )
     )
 
@@ -84,10 +272,14 @@ def suggest_name(user_ns, source, value):
             )
             print(i, word)
 
-    if not _symbols_error and not _symbols_running:
+    if not _symbols_error:
         suggestions = close_cached_symbol(attr, False)
         if suggestions:
-            print("Found the following symbols:")
+            status = _scan_status()
+            if status:
+                print("Found the following symbols (%s):" % status)
+            else:
+                print("Found the following symbols:")
             for i, (suggestion, code) in enumerate(suggestions, len(symbols_last)):
                 print(i, suggestion)
                 symbols_last.append(("exec", code))
@@ -96,6 +288,38 @@ def suggest_name(user_ns, source, value):
         _symbols_last = symbols_last
 
 
+def _type_index(cls):
+    # Adding, removing or renaming class attributes changes the fingerprint.
+    fingerprint = tuple(hash(frozenset(vars(c))) for c in cls.__mro__)
+    entry = _type_indexes.get(cls)
+    if entry is None or entry[0] != fingerprint:
+        entry = fingerprint, DeletionIndex(dir(cls))
+        _type_indexes[cls] = entry
+    return entry[1]
+
+
+def close_attributes(obj, attr):
+    """Return an iterator of the attributes of `obj` one edit away from `attr`.
+
+    Instances of classes without a custom `__dir__` have the attributes of
+    their class, which are indexed once per class, and those in their own
+    `__dict__`, which are searched one by one. Other objects, like modules,
+    are listed again, as the listing that completion cached before the cell
+    ran misses the attributes the cell added.
+    """
+    cls = type(obj)
+    if cls.__dir__ is not object.__dir__:
+        return close_words(attr, set(dir(obj)))
+    index = _type_index(cls)
+    extra = [
+        name
+        for name in getattr(obj, "__dict__", ())
+        if isinstance(name, str) and name not in index
+    ]
+    return itertools.chain(index.close_words(attr), close_words(attr, extra))
+
+
+@_timed
 def suggest_attr(user_ns, source, value):
     global _symbols_last
     m = re.search("(object|module '.*') has no attribute '(.*)'$", value)
@@ -108,13 +332,10 @@ def suggest_attr(user_ns, source, value):
     line = source[:index]
     varname = get_last_name(line)
     try:
-        lst = dir(eval(varname, user_ns))
+        suggestions = list(unique(close_attributes(eval(varname, user_ns), attr)))
     except:
         return
 
-    suggestions = list(
-        unique(itertools.chain(close_words(attr, lst), close_words(attr, _builtins)))
-    )
     if suggestions:
         _symbols_last = []
         print("Did you mean:")
@@ -124,9 +345,34 @@ def suggest_attr(user_ns, source, value):
             print(i, word)
 
 
+def get_suggestions_stats():
+    """Return the counters of the last scan and the latencies of recent queries.
+
+    The result only holds dictionaries, lists, strings and numbers, so it can
+    be dumped as JSON. ``"scan"`` is None until the first scan finishes, then
+    it has the totals and the per sys.path entry ``"roots"`` of the last scan,
+    whose ``"symbols"`` are None if the index of an earlier scan was reused.
+    ``"latency"`` has, for each query function, the number of calls and the
+    percentiles, in milliseconds, of the last `_stats_window` calls.
+    """
+    scan = None
+    if _scan_stats is not None:
+        scan = dict(_scan_stats, roots=[dict(root) for root in _scan_stats["roots"]])
+        for key in ("files", "bytes", "parsed", "bytes_read"):
+            scan[key] = sum(root[key] for root in scan["roots"])
+    latency = {}
+    for name in _timed_names:
+        times = sorted(_latencies[name])
+        latency[name] = entry = {"calls": _calls[name], "window": len(times)}
+        for q in (50, 95, 99):
+            entry["p%d_ms" % q] = 1e3 * times[len(times) * q // 100] if times else None
+        entry["max_ms"] = 1e3 * times[-1] if times else None
+    return {"scanning": _symbols_running, "scan": scan, "latency": latency}
+
+
 # Magic registration only works in ipython, and we don't
-# need it if we're in "__main__".
-if __name__ != "__main__":
+# need it if we're in "__main__" or in a scanner worker process.
+if __name__ != "__main__" and get_ipython() is not None:
 
     @register_line_magic
     @magic_arguments()
@@ -138,7 +384,28 @@ if __name__ != "__main__":
         const=True,
         default=False,
         help="If given the symbol search is exact. "
-        "Otherwise, the search allows two character edits.",
+        "Otherwise, the search allows one character edit of each kind.",
+    )
+    @argument(
+        "-d",
+        dest="distance",
+        type=int,
+        default=None,
+        help="Maximal number of character edits allowed in the symbol search.",
+    )
+    @argument(
+        "-n",
+        dest="limit",
+        type=int,
+        default=_findsymbol_limit,
+        help="Number of symbols to show, 0 for all.",
+    )
+    @argument(
+        "-p",
+        dest="page",
+        type=int,
+        default=1,
+        help="Page of symbols to show, starting from 1.",
     )
     @argument("symbol", type=str, help="Symbol to search for.")
     def findsymbol(arg):
@@ -148,7 +415,7 @@ if __name__ != "__main__":
             print("ipython-suggestions had an error while scanning.")
             return
 
-        if _symbols_running:
+        if _symbols is None:
             print("ipython-suggestions is still scanning symbols...")
             return
 
@@ -183,16 +450,122 @@ if __name__ != "__main__":
                 shell.run_cell(line, store_history=True)
             return
 
-        suggestions = close_cached_symbol(args.symbol, args.exact)
+        if args.limit > 0:
+            offset = args.limit * (max(args.page, 1) - 1)
+            # One more, to know if there's another page.
+            suggestions = close_cached_symbol(
+                args.symbol, args.exact, args.distance, args.limit + 1, offset
+            )
+            more = len(suggestions) > args.limit
+            del suggestions[args.limit :]
+        else:
+            suggestions = close_cached_symbol(args.symbol, args.exact, args.distance)
+            more = False
         if suggestions:
             _symbols_last = []
             print("Found the following symbols:")
             for i, (suggestion, code) in enumerate(suggestions):
                 print(i, suggestion + as_)
                 _symbols_last.append(("exec", code + as_))
+            if more:
+                print("Pass -p %d for more symbols." % (max(args.page, 1) + 1))
         else:
             print("Didn't find symbol.")
 
+        status = _scan_status()
+        if status:
+            print("ipython-suggestions is %s." % status)
+
+    @register_line_magic
+    def suggestions_memory(arg):
+        """Print the memory used by the symbol index."""
+        symbols = _symbols
+        if symbols is None:
+            print("ipython-suggestions has not finished scanning symbols.")
+            return
+
+        deletes = _symbols_deletes if _symbols is symbols else None
+        usage = symbols.memory_usage(deletes)
+        print("%d symbols, %d records" % (len(symbols), len(symbols.lines)))
+        if symbols.mapped:
+            print("The index is memory-mapped and shared between kernels.")
+        for part in ("names", "modules", "files", "records", "trie", "deletes"):
+            if part in usage:
+                print("%-28s %10.1f MB" % (part, usage[part] / 1e6))
+        print("%-28s %10.1f MB" % ("total", usage["total"] / 1e6))
+        print(
+            "%-28s %10.1f MB"
+            % ("nested dictionaries (est.)", symbols.dict_layout_memory_usage() / 1e6)
+        )
+
+    @register_line_magic
+    @magic_arguments()
+    @argument("-j", "--json", action="store_true", help="Print the stats as JSON.")
+    def suggestions_stats(arg):
+        """Print the scan counters and query latencies of `get_suggestions_stats`."""
+        args = parse_argstring(suggestions_stats, arg)
+        stats = get_suggestions_stats()
+        if args.json:
+            print(json.dumps(stats, indent=2, sort_keys=True))
+            return
+
+        scan = stats["scan"]
+        if scan is None:
+            print("ipython-suggestions has not finished scanning symbols.")
+        else:
+            print(
+                "%d files (%.1f MB), %d parsed (%.1f MB read), %d symbols in %.2f s%s"
+                % (
+                    scan["files"],
+                    scan["bytes"] / 1e6,
+                    scan["parsed"],
+                    scan["bytes_read"] / 1e6,
+                    scan["symbols"],
+                    scan["seconds"],
+                    ", reused the index" if scan["reused_index"] else "",
+                )
+            )
+            print(
+                "%8s %10s %10s %10s %8s  %s"
+                % ("files", "MB", "MB read", "symbols", "seconds", "sys.path entry")
+            )
+            for root in scan["roots"]:
+                print(
+                    "%8d %10.1f %10.1f %10s %8.2f  %s"
+                    % (
+                        root["files"],
+                        root["bytes"] / 1e6,
+                        root["bytes_read"] / 1e6,
+                        "-" if root["symbols"] is None else root["symbols"],
+                        root["seconds"],
+                        root["path"],
+                    )
+                )
+        if stats["scanning"]:
+            print("ipython-suggestions is scanning symbols.")
+
+        print()
+        print(
+            "%-28s %8s %10s %10s %10s %10s"
+            % ("latency", "calls", "p50 ms", "p95 ms", "p99 ms", "max ms")
+        )
+        for name in _timed_names:
+            entry = stats["latency"][name]
+            if entry["window"]:
+                print(
+                    "%-28s %8d %10.2f %10.2f %10.2f %10.2f"
+                    % (
+                        name,
+                        entry["calls"],
+                        entry["p50_ms"],
+                        entry["p95_ms"],
+                        entry["p99_ms"],
+                        entry["max_ms"],
+                    )
+                )
+            else:
+                print("%-28s %8d" % (name, 0))
+
     @register_line_magic
     @magic_arguments()
     @argument("suggestion_index", type=int, help="Index of suggestion to execute.")
@@ -221,34 +594,486 @@ if __name__ != "__main__":
 
 
 def load_ipython_extension(ipython):
+    global _history_file, _completer
     ipython.set_custom_exc((NameError, AttributeError), on_exception)
-    ipython.set_hook("complete_command", suggest_prefix, str_key="%findsymbol")
-    ipython.set_hook("complete_command", super_greedy_complete, re_key=".*")
+    hook = lambda func: func
+    if _async_complete == "1" or (
+        _async_complete == "kernel" and getattr(ipython, "kernel", None) is not None
+    ):
+        _completer = AsyncCompleter(_complete_deadline)
+        hook = _completer.wrap
+    ipython.set_hook("complete_command", hook(suggest_prefix), str_key="%findsymbol")
+    ipython.set_hook(
+        "complete_command", hook(_timed(super_greedy_complete)), re_key=".*"
+    )
+    ipython.events.register("post_run_cell", clear_completion_caches)
+    if _history and getattr(ipython, "history_manager", None) is not None:
+        _history_file = str(ipython.history_manager.hist_file)
+        if _history_file == ":memory:":
+            _history_file = None
     thread = Thread(target=inspect_all_objs)
     thread.daemon = True
     thread.start()
 
 
 def unload_ipython_extension(ipython):
-    global _symbols_cache, _symbols_running, _symbols_error, _symbols_last
-    _symbols_cache = defaultdict(lambda: defaultdict(dict))
-    _symbols_sorted = None
+    global _symbols, _symbols_deletes, _symbols_progress, _symbols_overlay
+    global _symbols_running, _symbols_error, _symbols_last, _watcher
+    global _user_ns_index, _scan_stats, _completer
+    if _watcher is not None:
+        _watcher.stop()
+        _watcher = None
+    if _completer is not None:
+        _completer.stop()
+        _completer = None
+    _symbols = None
+    _symbols_deletes = None
+    _symbols_overlay = None
+    _symbols_progress = None
     _symbols_running = False
     _symbols_error = False
     _symbols_last = None
+    _user_ns_index = None
+    _scan_stats = None
+    _latencies.clear()
+    _calls.clear()
+    try:
+        ipython.events.unregister("post_run_cell", clear_completion_caches)
+    except ValueError:
+        pass
+    clear_completion_caches()
     ipython.set_custom_exc((), None)
 
 
-def inspect_all_objs():
-    global _symbols_cache, _symbols_sorted, _symbols_running, _symbols_error
+def _cache_path(ext=".pickle"):
+    """Return the path of a cache file of this environment, or None.
+
+    Symbol tables are stored by absolute file path, so the table cache and
+    its lock are shared by all kernels of the interpreter, whatever their
+    working directory. The index also depends on the sys.path entries it
+    covers, which are all but the working directory. The tables of the
+    files in the working directory are cached apart, in a ".local" file of
+    that directory, which kernels that reuse the index load alone.
+    """
+    if not _cache_dir:
+        return None
+    parts = [sys.executable, str(_cache_version)]
+    if ext == ".index":
+        parts += [os.path.abspath(p or ".") for p in sys.path if not _local_path(p)]
+    elif ext == ".local":
+        parts.append(os.getcwd())
+    key = "\0".join(parts)
+    digest = hashlib.sha1(key.encode("utf-8", "replace")).hexdigest()[:16]
+    return os.path.join(_cache_dir, "symbols-%s%s" % (digest, ext))
+
+
+def _lock_cache():
+    """Take an exclusive lock on this environment's cache files.
+
+    Kernels started together wait for the first one to build the index, and
+    then open the index it wrote. Returns the lock file to close, or None.
+    """
+    path = _cache_path(".lock")
+    if path is None:
+        return None
+    try:
+        import fcntl
+
+        if not os.path.isdir(_cache_dir):
+            os.makedirs(_cache_dir)
+        f = open(path, "a")
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+    except:
+        return None
+
+
+def _load_file_cache(ext=".pickle"):
+    path = _cache_path(ext)
+    if path is None:
+        return {}
+    try:
+        with open(path, "rb") as f:
+            version, files = pickle.load(f)
+        if version == _cache_version:
+            return files
+    except:
+        pass
+    return {}
+
+
+def _save_file_cache(files, ext=".pickle"):
+    path = _cache_path(ext)
+    if path is None:
+        return
+    try:
+        if not os.path.isdir(_cache_dir):
+            os.makedirs(_cache_dir)
+        tmppath = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmppath, "wb") as f:
+            pickle.dump((_cache_version, files), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmppath, path)
+    except:
+        pass
 
-    _symbols_running = True
 
+def _scan_file(filepath):
+    """Return ``(symbols, imports)`` of a source file.
+
+    `symbols` is a list of ``(kind, name, lineno)`` of its top-level symbols,
+    and `imports` a tuple of the ``(modulepath, name)`` pairs it imports.
+    """
+    symbols = []
+    try:
+        with open(filepath, "rb") as f:
+            data = f.read()
+    except:
+        return symbols, ()
+
+    # Count lines like text mode does, with any kind of line ending.
+    if b"\r" in data:
+        data = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+
+    lineno = 0
+    pos = 0
+    for m in _symbol_re.finditer(data):
+        start = m.start()
+        lineno += data.count(b"\n", pos, start)
+        pos = start
+        t, sym, var = m.groups()
+        if t:
+            symbols.append((t.decode("ascii"), sym.decode("ascii"), lineno))
+        else:
+            symbols.append(("var", var.decode("ascii"), lineno))
+    return symbols, _import_pairs(data)
+
+
+def _import_pairs(data):
+    """Return a tuple of the ``(modulepath, name)`` pairs imported in `data`.
+
+    ``import a.b`` imports ``("a", "b")``, and ``from a.b import c`` imports
+    ``("a.b", "c")`` and the module ``("a", "b")``. Relative imports are
+    skipped, as they don't say which module they import.
+    """
+    pairs = set()
+    if b"import" not in data:
+        return ()
+    for m in _import_re.finditer(data):
+        frommodule, names, modules = m.groups()
+        if frommodule is not None:
+            dotted = [frommodule]
+            names = names.strip(b"()").replace(b"\\", b" ").split(b",")
+            frommodule = frommodule.decode("ascii")
+            for part in names:
+                part = part.split()
+                if part and part[0] != b"*" and _dotted_name.match(part[0]):
+                    pairs.add((frommodule, part[0].decode("ascii")))
+        else:
+            dotted = [part.split()[0] for part in modules.split(b",") if part.split()]
+        for name in dotted:
+            if _dotted_name.match(name):
+                modulepath, _, name = name.decode("ascii").rpartition(".")
+                pairs.add((modulepath, name))
+    return tuple(pairs)
+
+
+def _history_imports(path):
+    """Return a Counter of the ``(modulepath, name)`` pairs imported in the
+    cells of the IPython history database at `path`."""
+    import sqlite3
+
+    counts = Counter()
+    uri = pathlib.Path(os.path.abspath(path)).as_uri() + "?mode=ro"
+    db = sqlite3.connect(uri, uri=True)
+    try:
+        for (source,) in db.execute("SELECT source_raw FROM history"):
+            if source and "import" in source:
+                counts.update(_import_pairs(source.encode("utf-8", "replace")))
+    finally:
+        db.close()
+    return counts
+
+
+def _scan_file_list(filepaths):
+    return [_scan_file(filepath) for filepath in filepaths]
+
+
+def _make_scan_pool():
+    workers = _scan_workers or multiprocessing.cpu_count()
+    if workers <= 1:
+        return None
+    try:
+        # Forking a process that runs threads is unsafe, so workers are spawned.
+        return multiprocessing.get_context("spawn").Pool(workers)
+    except:
+        return None
+
+
+def _scan_files(filepaths, pool=None):
+    if pool is None or len(filepaths) <= _scan_chunksize:
+        return _scan_file_list(filepaths)
+    # Files come in walk order, so each chunk covers one or a few package
+    # directories. imap keeps the chunks in order, which keeps the merged
+    # index identical to the one built by the serial scanner.
+    chunks = [
+        filepaths[i : i + _scan_chunksize]
+        for i in range(0, len(filepaths), _scan_chunksize)
+    ]
+    return list(itertools.chain.from_iterable(pool.imap(_scan_file_list, chunks)))
+
+
+def _module_name(path, root, filename):
+    """Return ``(name, modulepath)`` of the module file `filename`, found in
+    the directory `root` under the sys.path entry `path`."""
+    if filename == "__init__.py":
+        name = root[len(path) + 1 :].split("/")[-1]
+        modulepath = ".".join(root[len(path) + 1 :].split("/")[:-1])
+    else:
+        name = filename[:-3]
+        modulepath = root[len(path) + 1 :].replace("/", ".")
+
+    if modulepath.endswith("."):
+        modulepath = modulepath[:-1]
+
+    return name, modulepath
+
+
+def _full_path(name, modulepath):
+    if modulepath:
+        return "%s.%s" % (modulepath, name)
+    return name
+
+
+def _excluded(filepath):
+    """Return whether the exclude rules skip the file or directory."""
+    name = os.path.basename(filepath)
+
+    def matches(patterns):
+        for pattern in patterns:
+            if os.sep in pattern:
+                if fnmatch.fnmatch(filepath, pattern):
+                    return True
+            elif fnmatch.fnmatch(name, pattern):
+                return True
+        return False
+
+    return matches(_exclude) and not matches(_include)
+
+
+def _walk_into(root, name):
+    """Return whether the walk descends into the directory `name` of `root`."""
+    dirpath = os.path.join(root, name)
+    if _excluded(dirpath):
+        return False
+    if _packages_only:
+        return _identifier.match(name) is not None and os.path.isfile(
+            os.path.join(dirpath, "__init__.py")
+        )
+    return True
+
+
+def _walk_path(path, objs, visited, inodes):
+    """Yield ``(filepath, fullpath)`` of the modules under `path` that are
+    not in `objs` yet, and register them there.
+
+    `visited` maps each walked directory to the sys.path entry it is in, and
+    `inodes` holds the ``(st_dev, st_ino)`` of the walked directories, so
+    that symlinked or overlapping trees are walked once.
+    """
+    if not os.path.isdir(path) or _excluded(path):
+        return
+
+    walk = os.walk(path)
+    if _profile is not None:
+        walk = _profiled_walk(walk)
+    for root, dirs, nondirs in walk:
+        if "-" in root[len(path) + 1 :] or root in visited:
+            dirs[:] = []
+            continue
+
+        try:
+            st = os.stat(root)
+        except OSError:
+            dirs[:] = []
+            continue
+        if (st.st_dev, st.st_ino) in inodes:
+            dirs[:] = []
+            continue
+        inodes.add((st.st_dev, st.st_ino))
+
+        visited[root] = path
+        dirs[:] = [name for name in dirs if _walk_into(root, name)]
+
+        for filename in nondirs:
+            if filename.endswith(".py"):
+                filepath = os.path.join(root, filename)
+                if _exclude and _excluded(filepath):
+                    continue
+                name, modulepath = _module_name(path, root, filename)
+
+                if ("module", modulepath) not in objs[name]:
+                    objs[name][("module", modulepath)] = (filepath, 0)
+                    yield filepath, _full_path(name, modulepath)
+
+
+def _profiled_walk(walk):
+    """Yield from the os.walk `walk`, and charge each directory in `_profile`
+    with the time spent listing it and handling its entries."""
+    start = time.perf_counter()
+    for root, dirs, nondirs in walk:
+        yield root, dirs, nondirs
+        now = time.perf_counter()
+        _profile[root][0] += now - start
+        start = now
+
+
+def _stat_path(path, objs, visited, inodes, files):
+    """Register the modules under `path` in `objs` and stat their files.
+
+    Stores ``(size, mtime, None, None)`` for each file in `files`, and returns the
+    list of ``(filepath, fullpath)`` of the modules.
+    """
+    modules = []
+    for filepath, fullpath in list(_walk_path(path, objs, visited, inodes)):
+        start = time.perf_counter()
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            continue
+
+        files[filepath] = (st.st_size, st.st_mtime_ns, None, None)
+        modules.append((filepath, fullpath))
+        if _profile is not None:
+            cost = _profile[os.path.dirname(filepath)]
+            cost[0] += time.perf_counter() - start
+            cost[1] += 1
+            cost[2] += st.st_size
+    return modules
+
+
+def _files_digest(roots, files):
+    h = hashlib.sha1(str(_cache_version).encode())
+    for modules in roots:
+        for filepath, fullpath in modules:
+            size, mtime = files[filepath][:2]
+            line = "%s\0%s\0%d\0%r\n" % (filepath, fullpath, size, mtime)
+            h.update(line.encode("utf-8", "surrogateescape"))
+    return h.digest()
+
+
+def _parse_files(modules, files, old_files, pool=None):
+    """Fill in the symbols and imports of the files of `modules`.
+
+    Cached symbol tables from `old_files` are reused for files whose size
+    and mtime did not change, the rest are parsed (in `pool`, if given).
+    Returns the paths of the parsed files.
+    """
+    stale = []
+    for filepath, _ in modules:
+        size, mtime = files[filepath][:2]
+        entry = old_files.get(filepath)
+        if entry is None or entry[0] != size or entry[1] != mtime:
+            stale.append(filepath)
+        else:
+            files[filepath] = entry
+
+    if _profile is None:
+        results = _scan_files(stale, pool)
+    else:
+        # Parse in this process, to time each file.
+        results = []
+        for filepath in stale:
+            start = time.perf_counter()
+            results.append(_scan_file(filepath))
+            _profile[os.path.dirname(filepath)][0] += time.perf_counter() - start
+
+    for filepath, scanned in zip(stale, results):
+        files[filepath] = files[filepath][:2] + scanned
+
+    return stale
+
+
+def _open_symbols(objs, digest, popularity=None):
+    """Build the symbol index from `objs`, and share it through the cache.
+
+    The index is written to the cache directory and opened memory-mapped,
+    so its pages are shared with other kernels of the same environment. If
+    that fails, the index stays in this process' memory.
+    """
+    symbols = SymbolStore(objs, popularity)
+    path = _cache_path(".index")
+    if path is not None:
+        try:
+            symbols.save(path, digest)
+            symbols = SymbolStore.open(path)
+        except:
+            pass
+    return symbols
+
+
+def _open_cached_symbols():
+    path = _cache_path(".index")
+    if path is not None and os.path.exists(path):
+        try:
+            return SymbolStore.open(path)
+        except:
+            pass
+    return None
+
+
+def _publish_symbols(symbols, deletes, progress=None, overlay=None):
+    """Make `symbols`, and the SymbolOverlay `overlay` of it, the index that
+    queries use.
+
+    `progress` is the fraction of files that `symbols` covers while the scan
+    runs, or None if it covers all of them.
+    """
+    global _symbols, _symbols_deletes, _symbols_progress, _symbols_overlay
+    # Queries read the deletion index and then look names up in the store,
+    # so a deletion index that is ahead of the store is harmless.
+    _symbols_deletes = deletes
+    _symbols = symbols
+    _symbols_overlay = overlay
+    _symbols_progress = progress
+
+
+def _scan_status():
+    """Return a note on how complete the index is, or None if it is."""
+    if not _symbols_running or _symbols is None:
+        return None
+    if _symbols_progress is None:
+        return "updating the symbol index, results may be out of date"
+    return (
+        "still scanning symbols (%d%% of files indexed), results may be incomplete"
+        % (100 * _symbols_progress)
+    )
+
+
+def _local_path(path):
+    """Return whether the sys.path entry `path` is the working directory."""
+    return os.path.abspath(path or ".") == os.getcwd()
+
+
+def _scan(on_root=None):
+    """Scan sys.path for symbols and imports.
+
+    Returns ``(symbols, local, visited, stats)``. `symbols` is a SymbolStore
+    of the symbols of all sys.path entries but the working directory,
+    memory-mapped from the cache directory when possible, so that kernels
+    of the same environment share it wherever they run. `local` maps the
+    source files in the working directory to their ``(name, modulepath,
+    symbols)``, for a SymbolOverlay. `visited` maps the walked directories
+    to their sys.path entries, and `stats` holds the file and symbol counts
+    and the time spent on each entry. Unless the cache holds an index of
+    the current files, ``on_root(objs, modules, files, progress)`` is called
+    after the files of each shared sys.path entry are indexed.
+    """
+    lock = _lock_cache()
     try:
-        visited = set()
-        defclass = re.compile(r"(class|def) ([_A-z][_A-z0-9]*)[\(:]")
-        variable = re.compile(r"([A-z][_A-z0-9]+)\s=")
+        visited = {}
+        inodes = set()
         objs = defaultdict(dict)
+        files = {}
 
         rootmodules = list(sys.builtin_module_names)
         for name in rootmodules:
@@ -261,68 +1086,956 @@ def inspect_all_objs():
                 elif callable(a):
                     objs[attr][("def", name)] = ("builtin", 0)
 
-        for path in sys.path:
-            if path == "":
-                path = "."
-
-            if os.path.isdir(path):
-                for root, dirs, nondirs in os.walk(path):
-                    if "-" in root[len(path) + 1 :] or root in visited:
-                        dirs[:] = []
+        # The shared entries are walked first, so that what they index does
+        # not depend on the working directory.
+        paths = [(p, False) for p in sys.path if not _local_path(p)]
+        paths += [(p, True) for p in sys.path if _local_path(p)]
+        roots = []
+        local_roots = []
+        local_objs = defaultdict(dict)
+        stats = {"reused_index": False, "roots": []}
+        for path, local in paths:
+            path = os.path.abspath(path or ".")
+            start = time.perf_counter()
+            modules = _stat_path(
+                path, local_objs if local else objs, visited, inodes, files
+            )
+            root = {
+                "path": path,
+                "local": local,
+                "files": len(modules),
+                "bytes": sum(files[filepath][0] for filepath, _ in modules),
+                "parsed": 0,
+                "bytes_read": 0,
+                "symbols": None,
+                "seconds": time.perf_counter() - start,
+            }
+            stats["roots"].append(root)
+            (local_roots if local else roots).append((path, modules, root))
+        del local_objs
+
+        # A kernel of the same environment may have written an index of
+        # exactly these files already, while we waited for the lock.
+        digest = _files_digest([modules for _, modules, _ in roots], files)
+        symbols = _open_cached_symbols()
+        reused = symbols is not None and symbols.digest == digest
+        if reused:
+            stats["reused_index"] = True
+            roots = []
+
+        # The shared table cache is only needed to build the index.
+        old_files = {} if reused else _load_file_cache()
+        old_local_files = _load_file_cache(".local") if local_roots else {}
+        popularity = Counter()
+        parsed = 0
+        indexed = 0
+        total = sum(len(modules) for _, modules, _ in roots)
+        local = {}
+        pool = _make_scan_pool()
+        try:
+            for path, modules, root in roots + local_roots:
+                start = time.perf_counter()
+                old = old_local_files if root["local"] else old_files
+                stale = _parse_files(modules, files, old, pool)
+                parsed += len(stale)
+                root["parsed"] = len(stale)
+                root["bytes_read"] = sum(files[filepath][0] for filepath in stale)
+                root["symbols"] = 0
+                for filepath, fullpath in modules:
+                    root["symbols"] += len(files[filepath][2])
+                    if root["local"]:
+                        directory, filename = os.path.split(filepath)
+                        name, modulepath = _module_name(path, directory, filename)
+                        local[filepath] = (name, modulepath, files[filepath][2])
                         continue
+                    for t, sym, i in files[filepath][2]:
+                        objs[sym][(t, fullpath)] = (filepath, i)
+                    popularity.update(files[filepath][3])
+                root["seconds"] += time.perf_counter() - start
+
+                indexed += len(modules)
+                if on_root is not None and modules and not root["local"]:
+                    on_root(objs, modules, files, indexed / float(total))
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+        local_files = {}
+        for _, modules, _ in local_roots:
+            local_files.update((fp, files.pop(fp)) for fp, _ in modules)
+        local_parsed = sum(root["parsed"] for _, _, root in local_roots)
+        if local_parsed or len(local_files) != len(old_local_files):
+            _save_file_cache(local_files, ".local")
+        del old_local_files, local_files
+
+        if reused:
+            return symbols, local, visited, stats
+
+        if parsed > local_parsed or len(files) != len(old_files):
+            _save_file_cache(files)
+        del old_files, files
+
+        if _history_file:
+            try:
+                popularity.update(_history_imports(_history_file))
+            except:
+                pass
+
+        return _open_symbols(objs, digest, popularity), local, visited, stats
+    finally:
+        if lock is not None:
+            lock.close()
+
+
+def _on_doubled_records(snapshot):
+    """Return an ``on_root`` callback for `_scan` that calls
+    ``snapshot(objs, progress)`` whenever the number of records indexed has
+    doubled since the last call.
+
+    Building the snapshots then costs at most about as much as building the
+    final index, which follows the last root, so no snapshot is taken there.
+    """
+    published = 0
+
+    def on_root(objs, modules, files, progress):
+        nonlocal published
+        if progress >= 1:
+            return
+        records = sum(map(len, objs.values()))
+        if records >= 2 * published:
+            published = records
+            snapshot(objs, progress)
+
+    return on_root
+
+
+def _scan_in_subprocess(on_snapshot=None):
+    """Run `_scan` in a child process with a lower priority.
+
+    The child sends its progress as a stream of pickled messages. Unless
+    `on_snapshot` is None, it saves snapshots of the index to the cache
+    directory as the scan goes, and ``on_snapshot(symbols, progress)`` is
+    called with each of them, memory-mapped. Returns ``(symbols, local,
+    visited, stats)`` like `_scan`. The index is built in the child in any
+    case, this process only opens or unpickles it.
+    """
+    code = (
+        "import pickle, sys; sys.path[:] = pickle.load(sys.stdin.buffer); "
+        "import ipython_suggestions; ipython_suggestions._scan_subprocess_main()"
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-c", code], stdin=subprocess.PIPE, stdout=subprocess.PIPE
+    )
+    snapshot_path = None
+    try:
+        settings = dict((name, globals()[name]) for name in _scanner_settings)
+        pickle.dump(sys.path, proc.stdin, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(settings, proc.stdin, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(on_snapshot is not None, proc.stdin, pickle.HIGHEST_PROTOCOL)
+        proc.stdin.close()
+
+        while True:
+            message = pickle.load(proc.stdout)
+            if message[0] == "snapshot":
+                _, snapshot_path, progress = message
+                try:
+                    symbols = SymbolStore.open(snapshot_path)
+                except:
+                    continue
+                on_snapshot(symbols, progress)
+            elif message[0] == "done":
+                _, path, symbols, local, visited, stats = message
+                break
+            else:
+                raise RuntimeError("The scanner process failed:\n%s" % message[1])
+    finally:
+        proc.stdout.close()
+        proc.wait()
+        if snapshot_path is not None:
+            try:
+                os.remove(snapshot_path)
+            except OSError:
+                pass
+
+    if path is not None:
+        symbols = SymbolStore.open(path)
+    return symbols, local, visited, stats
+
+
+def _scan_subprocess_main():
+    """Entry point of the scanner process started by `_scan_in_subprocess`."""
+    # Keep the pipe to ourselves, stray prints go to stderr.
+    out = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    globals().update(pickle.load(sys.stdin.buffer))
+    snapshots = pickle.load(sys.stdin.buffer)
+    try:
+        os.nice(_scanner_nice)
+    except (AttributeError, OSError):
+        pass
+
+    def send(message):
+        pickle.dump(message, out, pickle.HIGHEST_PROTOCOL)
+        out.flush()
+
+    # Snapshots are passed on as files, which the kernel maps instead of
+    # building them itself. Without a cache directory, there are none.
+    snapshot_path = _cache_path(".index")
+    if snapshot_path is not None:
+        snapshot_path = "%s.%d.partial" % (snapshot_path, os.getpid())
+
+    def snapshot(objs, progress):
+        try:
+            SymbolStore(objs).save(snapshot_path, b"")
+        except:
+            return
+        send(("snapshot", snapshot_path, progress))
+
+    on_root = None
+    if snapshots and snapshot_path is not None:
+        on_root = _on_doubled_records(snapshot)
+    try:
+        symbols, local, visited, stats = _scan(on_root)
+        visited = visited if _watch else {}
+        if symbols.mapped:
+            send(("done", _cache_path(".index"), None, local, visited, stats))
+        else:
+            # Send the deletion index along, so that nothing is left to build.
+            symbols.deletion_index()
+            send(("done", None, symbols, local, visited, stats))
+    except:
+        send(("error", traceback.format_exc()))
+    out.close()
+
+
+def inspect_all_objs():
+    global _symbols_running, _symbols_error, _scan_stats
+
+    _symbols_running = True
+    start = time.perf_counter()
+
+    # An index from an earlier session answers queries until it is checked.
+    symbols = _open_cached_symbols()
+    if symbols is not None:
+        _publish_symbols(symbols, symbols.deletion_index())
+
+    # Without an old index, publish snapshots of what is indexed so far.
+    def publish_partial(symbols, progress):
+        _publish_symbols(symbols, symbols.deletion_index(), progress)
 
-                    visited.add(root)
-
-                    for name in nondirs:
-                        if name.endswith(".py"):
-                            filepath = os.path.join(root, name)
-
-                            if name == "__init__.py":
-                                name = root[len(path) + 1 :].split("/")[-1]
-                                modulepath = ".".join(
-                                    root[len(path) + 1 :].split("/")[:-1]
-                                )
-                            else:
-                                name = name[:-3]
-                                modulepath = root[len(path) + 1 :].replace("/", ".")
-
-                            if modulepath.endswith("."):
-                                modulepath = modulepath[:-1]
-
-                            if ("module", modulepath) not in objs[name]:
-                                objs[name][("module", modulepath)] = (filepath, 0)
-
-                                try:
-                                    with open(filepath, "r") as f:
-                                        for i, line in enumerate(f):
-                                            if modulepath:
-                                                fullpath = "%s.%s" % (modulepath, name)
-                                            else:
-                                                fullpath = name
-
-                                            m = defclass.match(line)
-                                            if m:
-                                                t, sym = m.groups()
-                                                objs[sym][(t, fullpath)] = (filepath, i)
-                                            else:
-                                                m = variable.match(line)
-                                                if m:
-                                                    objs[m.group(1)][
-                                                        ("var", fullpath)
-                                                    ] = (filepath, i)
-                                except:
-                                    pass
-
-        for word, value in objs.items():
-            _symbols_cache[len(word)][word] = value
-
-        _symbols_sorted = sorted(sum(map(list, _symbols_cache.values()), []))
+    partial = symbols is None
+    try:
+        if _scanner == "process":
+            symbols, local, visited, stats = _scan_in_subprocess(
+                publish_partial if partial else None
+            )
+        else:
+            on_root = None
+            if partial:
+                on_root = _on_doubled_records(
+                    lambda objs, progress: publish_partial(SymbolStore(objs), progress)
+                )
+            symbols, local, visited, stats = _scan(on_root)
+        overlay = SymbolOverlay(symbols, local) if local else None
+        _publish_symbols(symbols, symbols.deletion_index(), overlay=overlay)
+        stats["seconds"] = time.perf_counter() - start
+        stats["finished"] = time.time()
+        stats["symbols"] = len(symbols)
+        stats["records"] = len(symbols.lines)
+        _scan_stats = stats
+
+        if _watch:
+            _start_watcher(visited)
     except:
         _symbols_error = True
     finally:
         _symbols_running = False
 
 
+def profile_scan(limit=30, collapsed=False, out=None):
+    """Scan sys.path, and report which directory subtrees the scan spent its
+    time on.
+
+    Writes to `out` (default stdout) the `limit` subtrees (0 for all) that
+    took the longest to walk, stat and parse, with their number of files and
+    bytes. With `collapsed`, writes instead one ``root;dir;subdir microseconds``
+    line per directory, the collapsed stack format of flamegraph.pl and
+    speedscope. Files are parsed in this process; unless `_cache_dir` is
+    empty, those with cached symbol tables are not parsed again, as in a kernel.
+    """
+    global _profile
+    out = out or sys.stdout
+    _profile = defaultdict(lambda: [0.0, 0, 0])
+    try:
+        start = time.perf_counter()
+        _, _, visited, _ = _scan()
+        elapsed = time.perf_counter() - start
+        profile = _profile
+    finally:
+        _profile = None
+
+    if collapsed:
+        for directory in sorted(profile):
+            microseconds = int(round(1e6 * profile[directory][0]))
+            if microseconds:
+                stack = _profile_stack(directory, visited)
+                out.write("%s %d\n" % (";".join(stack), microseconds))
+        return
+
+    subtrees = defaultdict(lambda: [0.0, 0, 0])
+    for directory, cost in profile.items():
+        stack = _profile_stack(directory, visited)
+        path = stack[0]
+        for i, name in enumerate(stack):
+            if i:
+                path = os.path.join(path, name)
+            total = subtrees[path]
+            for k in range(3):
+                total[k] += cost[k]
+
+    heaviest = sorted(subtrees.items(), key=lambda item: -item[1][0])
+    if limit:
+        heaviest = heaviest[:limit]
+    out.write(
+        "Scanned %d directories in %.2f s, %.2f s of which in the directories, "
+        "the rest in building the index\n"
+        % (len(profile), elapsed, sum(cost[0] for cost in profile.values()))
+    )
+    out.write(
+        "%8s %8s %8s %8s %10s  %s\n"
+        % ("seconds", "%", "self s", "files", "MB", "subtree")
+    )
+    for path, (seconds, nfiles, nbytes) in heaviest:
+        out.write(
+            "%8.2f %7.1f%% %8.2f %8d %10.1f  %s\n"
+            % (
+                seconds,
+                100 * seconds / elapsed if elapsed else 0,
+                profile[path][0] if path in profile else 0,
+                nfiles,
+                nbytes / 1e6,
+                path,
+            )
+        )
+
+
+def _profile_stack(directory, visited):
+    """Return the sys.path entry of `directory`, then the names of the
+    directories down to it."""
+    root = visited.get(directory, directory)
+    relpath = os.path.relpath(directory, root)
+    if relpath == ".":
+        return [root]
+    return [root] + relpath.split(os.sep)
+
+
+###############################################################################
+
+
+class SymbolStore(object):
+    """Columnar table of all scanned symbols.
+
+    `names` is the sorted list of distinct symbol names, and the records of
+    the name at index k are the rows ``starts[k]:starts[k + 1]`` of the
+    record arrays. A record holds a kind code (an index into `kinds`), the
+    ids of its module path and file path in the `modules` and `files`
+    string tables, a line number, the number of files (and history cells)
+    that import it, and its rank in %findsymbol completions, by which the
+    records of each name are sorted. Every string is stored once, and
+    records take 19 bytes instead of two tuples and a dictionary slot.
+
+    A store can be saved to a binary file, and opened memory-mapped from it
+    with `open`. Queries then read the mapped pages directly, so processes
+    that open the same file share its memory.
+    """
+
+    kinds = ("module", "class", "def", "var")
+
+    # The binary file starts with a header holding the magic, the digest
+    # of the scanned files, and the offset and size of each section.
+    _magic = b"IPYSUGG6"
+    _sections = (
+        ("names", "strings"),
+        ("modules", "strings"),
+        ("files", "strings"),
+        ("starts", "I"),
+        ("kind_codes", "B"),
+        ("module_ids", "I"),
+        ("file_ids", "I"),
+        ("lines", "I"),
+        ("popularity", "H"),
+        ("ranks", "I"),
+        ("deletes", "Q"),
+        ("delete_buckets", "I"),
+        ("trie_chars", "I"),
+        ("trie_children", "I"),
+        ("trie_ids", "i"),
+    )
+
+    digest = None
+    mapped = False
+    deletes = None
+    delete_buckets = None
+    trie_chars = None
+    trie_children = None
+    trie_ids = None
+
+    def __init__(self, objs, popularity=None):
+        """Build the store from `objs`, and `popularity`, which counts the
+        imports of each ``(modulepath, name)`` pair."""
+        kind_codes = dict((kind, i) for i, kind in enumerate(self.kinds))
+        module_ids = {}
+        file_ids = {}
+        popularity = popularity or {}
+
+        self.names = [intern(word) for word in sorted(objs)]
+        self.starts = array("I", [0])
+        self.kind_codes = array("B")
+        self.module_ids = array("I")
+        self.file_ids = array("I")
+        self.lines = array("I")
+        self.popularity = array("H")
+        self.ranks = array("I")
+        module_ranks = {}
+
+        for word in self.names:
+            records = []
+            for (t, modulepath), (filepath, lineno) in objs[word].items():
+                count = min(popularity.get((modulepath, word), 0), 0xFFFF)
+                module_rank = module_ranks.get(modulepath)
+                if module_rank is None:
+                    module_rank = module_ranks[modulepath] = _module_rank(modulepath)
+                records.append(
+                    (
+                        _prefix_rank("", module_rank, count),
+                        kind_codes[t],
+                        module_ids.setdefault(modulepath, len(module_ids)),
+                        file_ids.setdefault(filepath, len(file_ids)),
+                        lineno,
+                        count,
+                    )
+                )
+            records.sort()
+            for rank, kind_code, module_id, file_id, lineno, count in records:
+                self.ranks.append(rank)
+                self.kind_codes.append(kind_code)
+                self.module_ids.append(module_id)
+                self.file_ids.append(file_id)
+                self.lines.append(lineno)
+                self.popularity.append(count)
+            self.starts.append(len(self.lines))
+
+        self.modules = sorted(module_ids, key=module_ids.get)
+        self.files = sorted(file_ids, key=file_ids.get)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, word):
+        return self.index(word) is not None
+
+    def index(self, word):
+        k = bisect.bisect_left(self.names, word)
+        if k < len(self.names) and self.names[k] == word:
+            return k
+        return None
+
+    def prefix_range(self, key):
+        """Return the range of indices of names that start with `key`."""
+        i = bisect.bisect_left(self.names, key)
+        j = bisect.bisect_left(self.names, key[:-1] + chr(ord(key[-1]) + 1), i)
+        return i, j
+
+    def records(self, k, hidden=None):
+        """Yield ``(kind, modulepath, filepath, lineno, popularity)`` of the
+        name at `k`.
+
+        Records of the file ids in `hidden` are skipped.
+        """
+        for r in range(self.starts[k], self.starts[k + 1]):
+            if hidden and self.file_ids[r] in hidden:
+                continue
+            yield (
+                self.kinds[self.kind_codes[r]],
+                self.modules[self.module_ids[r]],
+                self.files[self.file_ids[r]],
+                self.lines[r],
+                self.popularity[r],
+            )
+
+    def ranked_prefix(self, key, limit, hidden=None):
+        """Return ``(rank, name, modulepath)`` of the best records of names
+        starting with `key`, best first.
+
+        Public names come first, then records in public modules, then the
+        most imported, then records in shallower modules. At most `limit`
+        records are returned, or all of them if `limit` is 0. Records of the
+        file ids in `hidden` are skipped.
+        """
+        i, j = self.prefix_range(key)
+        if i == j:
+            return []
+        starts = self.starts
+        ranks = self.ranks
+        file_ids = self.file_ids
+        if not limit:
+            best = sorted(
+                (ranks[r], k, r)
+                for k in range(i, j)
+                for r in range(starts[k], starts[k + 1])
+                if not hidden or file_ids[r] not in hidden
+            )
+        else:
+            # The records of a name are sorted by rank, so the scan of a name
+            # stops at the first record that is not better than the worst
+            # of the `limit` best so far. The heap holds them negated, worst
+            # first.
+            heap = []
+            worst = None
+            for k in range(i, j):
+                for r in range(starts[k], starts[k + 1]):
+                    rank = ranks[r]
+                    if worst is not None and rank >= worst:
+                        break
+                    if hidden and file_ids[r] in hidden:
+                        continue
+                    if len(heap) < limit:
+                        heapq.heappush(heap, (-rank, -k, -r))
+                        if len(heap) == limit:
+                            worst = -heap[0][0]
+                    else:
+                        heapq.heapreplace(heap, (-rank, -k, -r))
+                        worst = -heap[0][0]
+            best = sorted((-rank, -k, -r) for rank, k, r in heap)
+        # All names that start with `key` are private, or none of them.
+        private = _prefix_rank(key, 0, 0xFFFF)
+        names = self.names
+        module_ids = self.module_ids
+        return [
+            (private | rank, names[k], self.modules[module_ids[r]])
+            for rank, k, r in best
+        ]
+
+    def lookup(self, word, hidden=None):
+        k = self.index(word)
+        if k is None:
+            return iter(())
+        return self.records(k, hidden)
+
+    def import_counts(self):
+        """Return the import counts of the records, by ``(modulepath, name)``."""
+        counts = {}
+        for k, word in enumerate(self.names):
+            for r in range(self.starts[k], self.starts[k + 1]):
+                if self.popularity[r]:
+                    counts[self.modules[self.module_ids[r]], word] = self.popularity[r]
+        return counts
+
+    def deletion_index(self):
+        # The tables of a store in memory are built once, and kept with it,
+        # to be saved or pickled along.
+        if self.deletes is None:
+            self.deletes, self.delete_buckets = _deletion_tables(self.names)
+        words = self if self.mapped else frozenset(self.names)
+        return HashedDeletionIndex(words, self.names, self.deletes, self.delete_buckets)
+
+    def name_trie(self):
+        """Return the `_name_trie` of the names, for `close_trie_words`."""
+        if self.trie_chars is None:
+            self.trie_chars, self.trie_children, self.trie_ids = _name_trie(
+                self.names
+            )
+        return self.trie_chars, self.trie_children, self.trie_ids
+
+    def save(self, path, digest):
+        """Write the store, the deletion index and the trie of its names, to
+        `path`."""
+        tables = {}
+        if self.deletes is None:
+            tables.update(
+                zip(("deletes", "delete_buckets"), _deletion_tables(self.names))
+            )
+        if self.trie_chars is None:
+            parts = ("trie_chars", "trie_children", "trie_ids")
+            tables.update(zip(parts, _name_trie(self.names)))
+
+        chunks = []
+        for part, kind in self._sections:
+            table = tables[part] if part in tables else getattr(self, part)
+            if kind == "strings":
+                offsets = array("I", [0])
+                blob = []
+                for text in table:
+                    blob.append(text.encode("utf-8", "surrogateescape"))
+                    offsets.append(offsets[-1] + len(blob[-1]))
+                chunks.append(offsets.tobytes())
+                chunks.append(b"".join(blob))
+            else:
+                chunks.append(table.tobytes())
+        del tables
+
+        header = struct.Struct("<8s20s%dQ" % (2 * len(chunks)))
+        layout = []
+        offset = header.size
+        for chunk in chunks:
+            offset += -offset % 8
+            layout.extend((offset, len(chunk)))
+            offset += len(chunk)
+
+        tmppath = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmppath, "wb") as f:
+            f.write(header.pack(self._magic, digest, *layout))
+            for chunk, offset in zip(chunks, layout[::2]):
+                f.write(b"\0" * (offset - f.tell()))
+                f.write(chunk)
+        os.replace(tmppath, path)
+
+    @classmethod
+    def open(cls, path):
+        """Open a store saved to `path`, without reading it into memory."""
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mm)
+        magic, digest = struct.unpack_from("<8s20s", mm)
+        if magic != cls._magic:
+            raise ValueError("%s is not a symbol index" % path)
+        count = sum(2 if kind == "strings" else 1 for _, kind in cls._sections)
+        layout = struct.unpack_from("<%dQ" % (2 * count), mm, 28)
+        chunks = iter(
+            view[offset : offset + size]
+            for offset, size in zip(layout[::2], layout[1::2])
+        )
+
+        self = cls.__new__(cls)
+        for part, kind in cls._sections:
+            if kind == "strings":
+                offsets = next(chunks).cast("I")
+                setattr(self, part, _MappedStrings(offsets, next(chunks)))
+            else:
+                setattr(self, part, next(chunks).cast(kind))
+        self.digest = digest
+        self.mapped = True
+        self._mmap = mm
+        return self
+
+    def memory_usage(self, deletes=None):
+        """Return the bytes used by each part of the store, and by `deletes`,
+        its deletion index.
+
+        The parts of a mapped store are pages of the file, shared with all
+        processes that opened it.
+        """
+        usage = {}
+        for part in ("names", "modules", "files"):
+            strings = getattr(self, part)
+            if self.mapped:
+                usage[part] = strings.offsets.nbytes + strings.blob.nbytes
+            else:
+                usage[part] = sys.getsizeof(strings) + sum(
+                    map(sys.getsizeof, strings)
+                )
+        columns = [
+            getattr(self, part)
+            for part in (
+                "starts",
+                "kind_codes",
+                "module_ids",
+                "file_ids",
+                "lines",
+                "popularity",
+                "ranks",
+            )
+        ]
+        if self.mapped:
+            usage["records"] = sum(column.nbytes for column in columns)
+        else:
+            usage["records"] = sum(map(sys.getsizeof, columns))
+        if self.trie_chars is not None:
+            trie = (self.trie_chars, self.trie_children, self.trie_ids)
+            if self.mapped:
+                usage["trie"] = sum(table.nbytes for table in trie)
+            else:
+                usage["trie"] = sum(map(sys.getsizeof, trie))
+        if deletes is not None:
+            usage["deletes"] = deletes.memory_usage()
+        usage["total"] = sum(usage.values())
+        return usage
+
+    def dict_layout_memory_usage(self):
+        """Return the bytes the records would take in nested dictionaries.
+
+        This is the layout used before the store, a dictionary per name
+        length, mapping names to dictionaries from ``(kind, modulepath)`` to
+        ``(filepath, lineno)``. Module path strings are shared, so this is a
+        lower bound.
+        """
+        size = sys.getsizeof({})
+        by_length = defaultdict(dict)
+        for k, word in enumerate(self.names):
+            records = dict(
+                ((t, modulepath), (filepath, lineno))
+                for t, modulepath, filepath, lineno, _ in self.records(k)
+            )
+            by_length[len(word)][word] = records
+            size += sys.getsizeof(word) + sys.getsizeof(records)
+            for key, value in records.items():
+                size += sys.getsizeof(key) + sys.getsizeof(value)
+                size += sys.getsizeof(value[1])
+        size += sum(map(sys.getsizeof, by_length.values()))
+        size += sum(map(sys.getsizeof, self.modules))
+        size += sum(map(sys.getsizeof, self.files))
+        return size
+
+
+def _prefix_rank(name, module_rank, popularity):
+    """Rank of a record in %findsymbol completions, lower is better."""
+    private = name[:1] == "_"
+    return private << 25 | (module_rank >> 8) << 24 | (0xFFFF - popularity) << 8 | (
+        module_rank & 0xFF
+    )
+
+
+def _module_rank(modulepath):
+    """Rank of a module path in completions, lower is better.
+
+    Paths with a private or test package rank after public ones, and
+    deeper paths rank after shallower ones.
+    """
+    parts = modulepath.split(".") if modulepath else []
+    private = any(p.startswith("_") or p in _test_packages for p in parts)
+    return private << 8 | min(len(parts), 255)
+
+
+class _MappedStrings(Sequence):
+    """Sequence of the strings in a string table of a mapped SymbolStore."""
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, k):
+        if k < 0:
+            k += len(self)
+        offsets = self.offsets
+        return str(self.blob[offsets[k] : offsets[k + 1]], "utf-8", "surrogateescape")
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
+
+
+class SymbolOverlay(object):
+    """Symbols of files that changed after the SymbolStore `base` was built.
+
+    `files` maps the path of each changed file to ``(name, modulepath,
+    symbols)`` as returned by `_module_name` and `_scan_file`, or to None
+    if the file was removed. Records of these files in `base` are hidden by
+    their file ids, and their current records are kept here. Overlays are
+    small and never mutated, so a watcher builds a new one for every batch
+    of changes.
+    """
+
+    def __init__(self, base, files):
+        self.base = base
+        self.files = files
+        self.hidden = frozenset(
+            k for k, filepath in enumerate(base.files) if filepath in files
+        )
+        self.objs = defaultdict(dict)
+        for filepath, entry in files.items():
+            if entry is None:
+                continue
+            name, modulepath, symbols = entry
+            self.objs[name][("module", modulepath)] = (filepath, 0)
+            fullpath = _full_path(name, modulepath)
+            for t, sym, i in symbols:
+                self.objs[sym][(t, fullpath)] = (filepath, i)
+        self.names = sorted(self.objs)
+        self.deletes = DeletionIndex(self.names)
+        self.trie = None
+
+    def name_trie(self):
+        """Return the `_name_trie` of the names, for `close_trie_words`."""
+        if self.trie is None:
+            self.trie = _name_trie(self.names)
+        return self.trie
+
+    def lookup(self, word):
+        records = self.objs.get(word, {})
+        return (
+            (t, modulepath, filepath, lineno, 0)
+            for (t, modulepath), (filepath, lineno) in records.items()
+        )
+
+    def ranked_prefix(self, key, limit):
+        """Like `SymbolStore.ranked_prefix`, for the overlay's records."""
+        i = bisect.bisect_left(self.names, key)
+        j = bisect.bisect_left(self.names, key[:-1] + chr(ord(key[-1]) + 1), i)
+        candidates = (
+            (_prefix_rank(word, _module_rank(modulepath), 0), word, modulepath)
+            for word in self.names[i:j]
+            for _, modulepath in self.objs[word]
+        )
+        if limit:
+            return heapq.nsmallest(limit, candidates)
+        return sorted(candidates)
+
+
+class _InotifyWatcher(object):
+    """Watches directories with Linux inotify, and updates the overlay of
+    the published index with batches of changed source files.
+
+    `dirs` maps each directory to the sys.path entry it is in. A batch is
+    applied once no events came for `_watch_delay` seconds, or when its
+    first event is ten times that old.
+    """
+
+    _mask = 0x8 | 0x40 | 0x80 | 0x100 | 0x200  # close write, moves, create, delete
+    _isdir = 0x40000000
+    _ignored = 0x8000
+    _event = struct.Struct("iIII")
+
+    def __init__(self, dirs):
+        import ctypes
+        import ctypes.util
+
+        self._ctypes = ctypes
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._wake_r, self._wake_w = os.pipe()
+        self.watches = {}
+        self.full = False
+        for directory, path in dirs.items():
+            self.add(directory, path)
+
+    def add(self, directory, path):
+        if self.full:
+            return False
+        wd = self._libc.inotify_add_watch(
+            self.fd, os.fsencode(directory), self._mask
+        )
+        if wd < 0:
+            # Out of watches (ENOSPC), or the directory is gone.
+            self.full = self._ctypes.get_errno() == errno.ENOSPC
+            return False
+        self.watches[wd] = (directory, path)
+        return True
+
+    def stop(self):
+        os.write(self._wake_w, b"x")
+
+    def run(self):
+        changed = {}
+        removed_dirs = set()
+        first = None
+        try:
+            while True:
+                timeout = None
+                if first is not None:
+                    timeout = max(
+                        0, min(_watch_delay, first + 10 * _watch_delay - time.time())
+                    )
+                ready = select.select([self.fd, self._wake_r], [], [], timeout)[0]
+                if self._wake_r in ready:
+                    return
+                if self.fd in ready:
+                    self._read(changed, removed_dirs)
+                    if first is None and (changed or removed_dirs):
+                        first = time.time()
+                    if timeout != 0:
+                        continue
+                if first is not None:
+                    _apply_changes(changed, removed_dirs)
+                    changed = {}
+                    removed_dirs = set()
+                    first = None
+        finally:
+            for fd in (self.fd, self._wake_r, self._wake_w):
+                os.close(fd)
+
+    def _read(self, changed, removed_dirs):
+        data = os.read(self.fd, 65536)
+        pos = 0
+        while pos + self._event.size <= len(data):
+            wd, mask, _, length = self._event.unpack_from(data, pos)
+            pos += self._event.size
+            name = os.fsdecode(data[pos : pos + length].rstrip(b"\0"))
+            pos += length
+
+            if mask & self._ignored:
+                self.watches.pop(wd, None)
+                continue
+            if wd not in self.watches or not name:
+                continue
+            directory, path = self.watches[wd]
+            filepath = os.path.join(directory, name)
+
+            if mask & self._isdir:
+                if mask & (0x40 | 0x200):
+                    removed_dirs.add(filepath)
+                elif "-" not in filepath[len(path) + 1 :] and _walk_into(
+                    directory, name
+                ):
+                    # A new package: watch it and index its files.
+                    for root, dirs, nondirs in os.walk(filepath):
+                        if "-" in root[len(path) + 1 :]:
+                            dirs[:] = []
+                            continue
+                        self.add(root, path)
+                        dirs[:] = [d for d in dirs if _walk_into(root, d)]
+                        for filename in nondirs:
+                            if filename.endswith(".py"):
+                                changed[os.path.join(root, filename)] = path
+            elif name.endswith(".py") and not _excluded(filepath):
+                changed[filepath] = path
+
+
+def _apply_changes(changed, removed_dirs):
+    """Re-index the files in `changed`, which maps each changed source file
+    to its sys.path entry, and drop the files under `removed_dirs`."""
+    global _symbols_overlay
+    symbols = _symbols
+    if symbols is None:
+        return
+    overlay = _symbols_overlay
+    files = dict(overlay.files) if overlay is not None else {}
+
+    if removed_dirs:
+        prefixes = tuple(directory + os.sep for directory in removed_dirs)
+        for filepath in itertools.chain(symbols.files, list(files)):
+            if filepath.startswith(prefixes):
+                files[filepath] = None
+
+    for filepath, path in changed.items():
+        if os.path.isfile(filepath):
+            root, filename = os.path.split(filepath)
+            name, modulepath = _module_name(path, root, filename)
+            files[filepath] = (name, modulepath, _scan_file(filepath)[0])
+        else:
+            files[filepath] = None
+
+    if _symbols is symbols:
+        _symbols_overlay = SymbolOverlay(symbols, files)
+
+
+def _start_watcher(dirs):
+    global _watcher
+    if _watcher is not None or not sys.platform.startswith("linux"):
+        return
+    try:
+        _watcher = _InotifyWatcher(dirs)
+    except:
+        return
+    thread = Thread(target=_watcher.run)
+    thread.daemon = True
+    thread.start()
+
+
 ###############################################################################
 
 
@@ -372,60 +2085,454 @@ def unique(it):
             yield w
 
 
-def close_cached_symbol(word, exact):
-    suggestions = []
+class DeletionIndex(object):
+    """Index of all single-character deletions of a set of words.
 
-    if not exact and len(word) >= 3:
-        words = unique(
-            itertools.chain(
-                close_deletions(word, _symbols_cache[len(word) - 1]),
-                close_transposes(word, _symbols_cache[len(word)]),
-                close_insertions(word, _symbols_cache[len(word) + 1]),
-                close_substitutions(word, _symbols_cache[len(word)]),
-            )
+    Finds the same words as `close_words` with hash lookups, instead of
+    slicing every known word for every query (symmetric delete, as in
+    SymSpell).
+    """
+
+    def __init__(self, words=()):
+        self.words = set()
+        self.deletes = {}
+        for word in words:
+            self.add(word)
+
+    def __contains__(self, word):
+        return word in self.words
+
+    def __len__(self):
+        return len(self.words)
+
+    def add(self, word):
+        if word in self.words:
+            return
+        self.words.add(word)
+        deletes = self.deletes
+        for d in set(word[:i] + word[i + 1 :] for i in range(len(word))):
+            # Most deletions belong to a single word, which is stored as is
+            # to save the memory of a list.
+            other = deletes.get(d)
+            if other is None:
+                deletes[d] = word
+            elif type(other) is list:
+                other.append(word)
+            else:
+                deletes[d] = [other, word]
+
+    def discard(self, word):
+        if word not in self.words:
+            return
+        self.words.remove(word)
+        deletes = self.deletes
+        for d in set(word[:i] + word[i + 1 :] for i in range(len(word))):
+            other = deletes[d]
+            if type(other) is not list:
+                del deletes[d]
+            else:
+                other.remove(word)
+                if len(other) == 1:
+                    deletes[d] = other[0]
+
+    def memory_usage(self):
+        """Return the bytes used by the index, but not by the words."""
+        size = sys.getsizeof(self.words) + sys.getsizeof(self.deletes)
+        for d, words in self.deletes.items():
+            size += sys.getsizeof(d)
+            if type(words) is list:
+                size += sys.getsizeof(words)
+        return size
+
+    def _deleted_from(self, d):
+        words = self.deletes.get(d)
+        if words is None:
+            return ()
+        return words if type(words) is list else (words,)
+
+    def close_insertions(self, word):
+        return iter(self._deleted_from(word))
+
+    def close_substitutions(self, word):
+        for i in range(len(word)):
+            d = word[:i] + word[i + 1 :]
+            for w in self._deleted_from(d):
+                if w[:i] + w[i + 1 :] == d:
+                    yield w
+
+    def close_words(self, word):
+        return itertools.chain(
+            close_deletions(word, self),
+            close_transposes(word, self),
+            self.close_insertions(word),
+            self.close_substitutions(word),
         )
-    elif word in _symbols_cache[len(word)]:
-        words = [word]
-    else:
-        words = []
-
-    for word in words:
-        for (t, modulepath), (filepath, linenum) in _symbols_cache[len(word)][
-            word
-        ].items():
-            if t == "module":
-                if filepath not in ["builtin", ""]:
-                    tag = "M"
-                else:
-                    tag = "BM"
 
-                if modulepath == "" or filepath == "builtin":
-                    suggestions.append(
-                        ("(%s) import %s" % (tag, word), "import %s" % word)
-                    )
-                else:
-                    suggestions.append(
-                        (
-                            "(%s) from %s import %s" % (tag, modulepath, word),
-                            "from %s import %s" % (modulepath, word),
-                        )
-                    )
+
+class HashedDeletionIndex(DeletionIndex):
+    """Read-only DeletionIndex of a sorted sequence of distinct names.
+
+    `words` is a container of the names, and `deletes` and `buckets` are
+    their tables built by `_deletion_tables`, in memory or in the file of a
+    mapped SymbolStore. Names found by hash are checked, so hash collisions
+    don't matter.
+    """
+
+    def __init__(self, words, names, deletes, buckets):
+        self.words = words
+        self.names = names
+        self.deletes = deletes
+        self.buckets = buckets
+
+    def add(self, word):
+        raise TypeError("a hashed deletion index is read-only")
+
+    def memory_usage(self):
+        """Return the bytes used by the index, but not by the names."""
+        size = 0
+        for table in (self.deletes, self.buckets):
+            if isinstance(table, memoryview):
+                size += table.nbytes
             else:
-                if t == "class":
-                    tag = "C"
-                elif t == "def":
-                    tag = "F"
-                else:  # t == 'var'
-                    tag = "V"
-
-                suggestions.append(
-                    (
-                        "(%s) from %s import %s" % (tag, modulepath, word),
-                        "from %s import %s" % (modulepath, word),
-                    )
-                )
+                size += sys.getsizeof(table)
+        if isinstance(self.words, frozenset):
+            size += sys.getsizeof(self.words)
+        return size
+
+    discard = add
+
+    def _deleted_from(self, d):
+        h = _deletion_hash(d)
+        deletes = self.deletes
+        end = self.buckets[(h >> 16) + 1]
+        lo = bisect.bisect_left(deletes, h << 32, self.buckets[h >> 16], end)
+        hi = bisect.bisect_left(deletes, (h + 1) << 32, lo, end)
+        names = self.names
+        return [
+            w
+            for w in (names[deletes[i] & 0xFFFFFFFF] for i in range(lo, hi))
+            if len(w) == len(d) + 1 and _deletes_to(w, d)
+        ]
+
+
+def _deletion_hash(d):
+    return zlib.crc32(d.encode("utf-8", "surrogateescape"))
+
+
+def _deletion_tables(names):
+    """Return the deletion tables of the sorted sequence of names `names`.
+
+    Instead of a dictionary of strings, the deletions are stored in one
+    sorted array, of the 32-bit hash of each deletion above the id of the
+    name it comes from, 8 bytes a deletion. The second array holds the start
+    of the hashes with each value of their top 16 bits, so that lookups
+    bisect a few entries only.
+    """
+    deletes = array(
+        "Q",
+        (
+            _deletion_hash(d) << 32 | k
+            for k, word in enumerate(names)
+            for d in set(word[:i] + word[i + 1 :] for i in range(len(word)))
+        ),
+    )
+    counts = array("I", bytes(4 * 0x10000))
+    for x in deletes:
+        counts[x >> 48] += 1
+    buckets = array("I", itertools.chain([0], itertools.accumulate(counts)))
+
+    # Sorting all of them at once would take a Python int and a list slot for
+    # each. Instead they are moved to their buckets in place, and then the
+    # buckets are sorted one at a time.
+    free = buckets[:-1]
+    for b in range(0x10000):
+        end = buckets[b + 1]
+        for i in range(free[b], end):
+            x = deletes[i]
+            t = x >> 48
+            while t != b:
+                j = free[t]
+                free[t] = j + 1
+                deletes[j], x = x, deletes[j]
+                t = x >> 48
+            deletes[i] = x
+        free[b] = end
+        start = buckets[b]
+        if end - start > 1:
+            deletes[start:end] = array("Q", sorted(deletes[start:end]))
+    return deletes, buckets
+
+
+def _deletes_to(word, d):
+    """Return whether deleting a character of `word` gives `d`."""
+    i = 0
+    while i < len(d) and word[i] == d[i]:
+        i += 1
+    return word[i + 1 :] == d[i:]
+
+
+class NamespaceIndex(DeletionIndex):
+    """DeletionIndex of the names in a namespace dict.
+
+    `update` applies the names added to and removed from the namespace since
+    the last update, instead of indexing all of them again.
+    """
+
+    def __init__(self, namespace):
+        DeletionIndex.__init__(self)
+        self.namespace = namespace
+        self.update()
+
+    def update(self):
+        names = set(self.namespace)
+        for word in self.words - names:
+            self.discard(word)
+        for word in names - self.words:
+            if isinstance(word, str):
+                self.add(word)
+
+
+def _name_trie(names):
+    """Return the trie of the sorted sequence of names `names`, in arrays.
+
+    Nodes are numbered breadth first, from the root at 0. Node x holds the
+    code point ``chars[x]`` of its last character, and ``ids[x]``, the index
+    in `names` of the name it spells, or -1. Its children are the nodes
+    ``children[x]:children[x + 1]``, in the order of their characters.
+    """
+    chars = array("I", [0])
+    children = array("I")
+    ids = array("i")
+    # The names of the nodes of the next level, as ranges of `names`.
+    level = [(0, len(names))]
+    depth = 0
+    while level:
+        next_level = []
+        for lo, hi in level:
+            if lo < hi and len(names[lo]) == depth:
+                ids.append(lo)
+                lo += 1
+            else:
+                ids.append(-1)
+            children.append(len(chars))
+            while lo < hi:
+                ch = names[lo][depth]
+                end = lo + 1
+                while end < hi and names[end][depth] == ch:
+                    end += 1
+                chars.append(ord(ch))
+                next_level.append((lo, end))
+                lo = end
+        level = next_level
+        depth += 1
+    children.append(len(chars))
+    return chars, children, ids
+
+
+def close_trie_words(word, maxdist, trie, names):
+    """Yield the names within `maxdist` edits of `word`, in sorted order.
+
+    `trie` is the `_name_trie` of `names`. Edits are deletions, insertions,
+    substitutions and transposes of adjacent characters (optimal string
+    alignment distance). The trie is walked depth first, computing the row
+    of the distance matrix of each node from its parent's, and skipping the
+    subtrees of nodes already too far from `word`.
+    """
+    chars, children, ids = trie
+    n = len(word)
+    far = maxdist + 1
+    # The positions in `word` of each of its characters, as bits 1 to n.
+    masks = {}
+    for j, ch in enumerate(word, 1):
+        masks[ord(ch)] = masks.get(ord(ch), 0) | 1 << j
+
+    # Rows are shared by many nodes of the same depth, so they are computed
+    # once per row, and character mask, as the states of an automaton. Only
+    # cells within `maxdist` of the diagonal are computed, the rest are
+    # capped at `far`. Transposes also need the row before, and the mask of
+    # the last character.
+    rows = [tuple(min(j, far) for j in range(n + 1))]
+    depths = [0]
+    befores = [None]
+    lastmasks = [0]
+    rowmins = [0]
+    states = {}
+    transitions = {}
+
+    def step(s, mask):
+        above = rows[s]
+        before = befores[s]
+        lastmask = lastmasks[s]
+        size = depths[s] + 1
+        row = [far] * (n + 1)
+        row[0] = rowmin = size if size < far else far
+        for j in range(max(1, size - maxdist), min(n, size + maxdist) + 1):
+            v = above[j - 1] + (not mask >> j & 1)
+            if above[j] < v:
+                v = above[j] + 1
+            if row[j - 1] < v:
+                v = row[j - 1] + 1
+            if (
+                before is not None
+                and mask >> (j - 1) & 1
+                and lastmask >> j & 1
+                and before[j - 2] < v
+            ):
+                v = before[j - 2] + 1
+            if v > far:
+                v = far
+            row[j] = v
+            if v < rowmin:
+                rowmin = v
+        row = tuple(row)
+        key = size, row, above, mask
+        t = states.get(key)
+        if t is None:
+            t = states[key] = len(rows)
+            rows.append(row)
+            depths.append(size)
+            befores.append(above)
+            lastmasks.append(mask)
+            rowmins.append(rowmin)
+        transitions[s, mask] = t
+        return t
+
+    if ids[0] >= 0 and n <= maxdist:
+        yield names[ids[0]]
+    # Ranges of sibling nodes left to visit, with the state of their parent.
+    stack = [(children[0], children[1], 0)]
+    while stack:
+        x, end, s = stack.pop()
+        if x + 1 < end:
+            stack.append((x + 1, end, s))
+        mask = masks.get(chars[x], 0)
+        t = transitions.get((s, mask))
+        if t is None:
+            t = step(s, mask)
+        if rowmins[t] > maxdist:
+            continue
+        if ids[x] >= 0 and rows[t][n] <= maxdist:
+            yield names[ids[x]]
+        if children[x] < children[x + 1]:
+            stack.append((children[x], children[x + 1], t))
+
+
+def close_distance_words(word, maxdist, sorted_words):
+    """Yield the words of `sorted_words` within `maxdist` edits of `word`,
+    like `close_trie_words`."""
+    return close_trie_words(word, maxdist, _name_trie(sorted_words), sorted_words)
+
+
+def osa_distance(a, b):
+    """Return the optimal string alignment distance between `a` and `b`."""
+    before, prev = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        row = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            row[j] = min(
+                prev[j] + 1, row[j - 1] + 1, prev[j - 1] + (a[i - 1] != b[j - 1])
+            )
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                row[j] = min(row[j], before[j - 2] + 1)
+        before, prev = prev, row
+    return prev[-1]
+
+
+def _third_party(filepath):
+    if filepath in ("builtin", ""):
+        return False
+    return not filepath.startswith(_stdlib_dirs) or any(
+        d in filepath for d in _site_dirs
+    )
 
-    return sorted(suggestions, key=lambda key: key[1])
+
+def _symbol_line(word, t, modulepath, filepath):
+    """Return the `(suggestion, code)` pair of a symbol record."""
+    if t == "module":
+        tag = "M" if filepath not in ["builtin", ""] else "BM"
+        if modulepath == "" or filepath == "builtin":
+            return "(%s) import %s" % (tag, word), "import %s" % word
+    else:
+        tag = _kind_tags[t]
+    code = "from %s import %s" % (modulepath, word)
+    return "(%s) %s" % (tag, code), code
+
+
+@_timed
+def close_cached_symbol(word, exact, maxdist=None, limit=None, offset=0):
+    """Return the `(suggestion, code)` pairs of the symbols close to `word`.
+
+    Symbols are ranked by edit distance, then public names and modules before
+    private ones, then the most imported first, then by kind (`_kind_ranks`),
+    with the standard library before third party packages, then shallow
+    modules before deep ones. Only
+    the `limit` best after the first `offset` are returned, or all if `limit`
+    is None.
+    """
+    symbols = _symbols
+    if symbols is None:
+        return []
+    overlay = _symbols_overlay
+    if overlay is not None and overlay.base is not symbols:
+        overlay = None
+
+    if not exact and maxdist is not None:
+        words = close_trie_words(word, maxdist, symbols.name_trie(), symbols.names)
+        if overlay is not None:
+            words = itertools.chain(
+                words,
+                close_trie_words(word, maxdist, overlay.name_trie(), overlay.names),
+            )
+    elif not exact and len(word) >= 3:
+        words = _symbols_deletes.close_words(word)
+        if overlay is not None:
+            words = itertools.chain(words, overlay.deletes.close_words(word))
+    else:
+        words = [word]
+
+    query = word
+    module_ranks = {}
+    scored = {}
+    for word in unique(words):
+        if word == query:
+            distance = 0
+        elif maxdist is None:
+            distance = 1
+        else:
+            distance = osa_distance(query, word)
+        if overlay is None:
+            records = symbols.lookup(word)
+        else:
+            records = itertools.chain(
+                symbols.lookup(word, overlay.hidden), overlay.lookup(word)
+            )
+        for t, modulepath, filepath, linenum, popularity in records:
+            rank = module_ranks.get(modulepath)
+            if rank is None:
+                rank = module_ranks[modulepath] = _module_rank(modulepath)
+            key = word, t, modulepath
+            score = (
+                distance,
+                word.startswith("_") or rank >> 8,
+                -popularity,
+                _kind_ranks[t],
+                _third_party(filepath),
+                rank & 0xFF,
+                modulepath,
+                word,
+            )
+            if key not in scored or score < scored[key][0]:
+                scored[key] = score, filepath
+
+    items = ((score, key, filepath) for key, (score, filepath) in scored.items())
+    if limit is None:
+        best = sorted(items)[offset:]
+    else:
+        best = heapq.nsmallest(offset + limit, items)[offset:]
+    return [
+        _symbol_line(word, t, modulepath, filepath)
+        for _, (word, t, modulepath), filepath in best
+    ]
 
 
 ###############################################################################
@@ -473,6 +2580,48 @@ def get_last_name(line):
 
 
 if __name__ == "__main__":
+    if sys.argv[1:]:
+        import argparse
+
+        parser = argparse.ArgumentParser(
+            description="Profile the scan of sys.path, or print the IPython "
+            "configuration that loads ipython-suggestions if no option is given."
+        )
+        parser.add_argument(
+            "--profile",
+            action="store_true",
+            help="Report the directory subtrees that take the longest to scan.",
+        )
+        parser.add_argument(
+            "-n",
+            dest="limit",
+            type=int,
+            default=30,
+            help="Number of subtrees to report, 0 for all.",
+        )
+        parser.add_argument(
+            "--collapsed",
+            action="store_true",
+            help="Write collapsed stacks for flamegraph.pl or speedscope instead.",
+        )
+        parser.add_argument(
+            "--cache",
+            action="store_true",
+            help="Reuse the cached symbol tables, like a kernel does.",
+        )
+        parser.add_argument("-o", "--output", help="File to write the report to.")
+        args = parser.parse_args()
+        if not args.profile:
+            parser.error("nothing to do, pass --profile")
+        if not args.cache:
+            _cache_dir = ""
+        if args.output:
+            with open(args.output, "w") as out:
+                profile_scan(args.limit, args.collapsed, out)
+        else:
+            profile_scan(args.limit, args.collapsed)
+        sys.exit()
+
     if os.isatty(sys.stdout.fileno()):
         print(
             """\
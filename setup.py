@@ -18,6 +18,6 @@ if __name__ == "__main__":
             "Programming Language :: Python :: 3",
         ],
         py_modules=["ipython_suggestions", "super_greedy_complete"],
-        python_requires=">=2.7.10",
-        install_requires=["ipython>=4.0", 'future;python_version<"3"'],
+        python_requires=">=3.5",
+        install_requires=["ipython>=4.0"],
     )
@@ -2,6 +2,13 @@ import os
 import re
 import string
 import keyword
+import bisect
+import heapq
+import weakref
+import ast
+import threading
+import time
+from collections import OrderedDict
 
 
 FILENAME_CHARS = string.ascii_letters + string.digits + os.curdir + "._~#$:- "
@@ -134,6 +141,9 @@ class Parser(object):
         self.tabwidth = tabwidth
         self.str = ''
         self.study_level = 0
+        self.continuation = None
+        self.checkpoint_limit = 0
+        self.resume_from = None
 
     def set_str(self, s):
         assert len(s) == 0 or s[-1] == '\n'
@@ -152,6 +162,7 @@ class Parser(object):
             s = "".join(s)
         self.str = s
         self.study_level = 0
+        self.continuation = None
 
     # Return index of a good place to begin parsing, as close to the
     # end of the string as possible.  This will be the start of some
@@ -226,9 +237,10 @@ class Parser(object):
     # Creates self.{goodlines, continuation}.
 
     def _study1(self):
-        if self.study_level >= 1:
+        # A resumed _study2 skips this, leaving continuation None.
+        if self.study_level >= 1 and self.continuation is not None:
             return
-        self.study_level = 1
+        self.study_level = max(self.study_level, 1)
 
         # Map all uninteresting characters to "x", all open brackets
         # to "(", all close brackets to ")", then collapse runs of
@@ -376,11 +388,24 @@ class Parser(object):
     def _study2(self):
         if self.study_level >= 2:
             return
+        str_ = self.str
+        if self.resume_from is not None:
+            (limit, p, lastch, stack, n), bracketing = self.resume_from
+            # The resumed stmt spanned its whole str, and so does this one
+            # if no line was added and its first line isn't junk.  Then
+            # the stmt bounds are known without _study1.
+            if str_.count('\n', limit) == 1 and not _junkre(str_, 0):
+                self.study_level = 2
+                self.stmt_start, self.stmt_end = 0, len(str_)
+                self._study_stmt(p, len(str_), lastch, list(stack),
+                                 list(bracketing[:n]))
+                return
+            self.resume_from = None
         self._study1()
         self.study_level = 2
 
         # Set p and q to slice indices of last interesting stmt.
-        str_, goodlines = self.str, self.goodlines
+        goodlines = self.goodlines
         i = len(goodlines) - 1
         p = len(str_)    # index of newest line
         q = len(str_)
@@ -404,13 +429,25 @@ class Parser(object):
             q = p
         self.stmt_start, self.stmt_end = p, q
 
-        # Analyze this stmt, to find the last open bracket (if any)
-        # and last interesting character (if any).
-        lastch = ""
-        stack = []  # stack of open bracket indices
+        self._study_stmt(p, q, "", [], [(p, 0)])
+
+    # Analyze the stmt str[p:q], to find the last open bracket (if any)
+    # and last interesting character (if any), starting from the given
+    # scan state.
+
+    def _study_stmt(self, p, q, lastch, stack, bracketing):
+        str_ = self.str
+        # Checkpoints are only comparable between stmts that span the
+        # whole str, since both bounds are given to the regexps below.
+        if self.stmt_start == 0 and q == len(str_):
+            limit = self.checkpoint_limit
+        else:
+            limit = 0
         push_stack = stack.append
-        bracketing = [(p, 0)]
         while p < q:
+            if p < limit:
+                self.checkpoint = (limit, p, lastch, tuple(stack),
+                                   len(bracketing))
             # suck up all except ()[]{}'"#\\
             m = _chew_ordinaryre(str_, p, q)
             if m:
@@ -610,6 +647,27 @@ class Parser(object):
         self._study2()
         return self.stmt_bracketing
 
+    # State of the bracketing analysis of the last interesting stmt at the
+    # start of its last token that begins before index checkpoint_limit,
+    # or None.  The tokens before that index are analyzed by looking at
+    # the str before the limit alone, so the analysis of a str with the
+    # same first checkpoint_limit chars may resume from there.
+    checkpoint = None
+
+    # Record the checkpoint of the next analysis before index limit.
+
+    def set_checkpoint_limit(self, limit):
+        self.checkpoint_limit = limit
+
+    # Resume the analysis of the last interesting stmt from the checkpoint
+    # and stmt_bracketing of a Parser whose str agreed with this one up to
+    # its checkpoint_limit, and whose last stmt spanned its whole str.  It
+    # is only used when this str adds no line to that one; otherwise the
+    # analysis starts from scratch and resume_from is reset to None.
+
+    def resume(self, checkpoint, bracketing):
+        self.resume_from = checkpoint, bracketing
+
 
 #############################################################################################################
 #############################################################################################################
@@ -617,21 +675,57 @@ class Parser(object):
 #############################################################################################################
 
 
+# Number of lines whose parser state is kept, so that completing a line
+# that extends one of them, as happens on every keystroke, resumes its
+# bracketing analysis instead of starting over.
+_parser_states_size = 32
+_parser_states = OrderedDict()
+
+
+def _line_bracketing(line):
+    """Return the bracketing and openers of the statement ending `line`."""
+    state = _parser_states.get(line)
+    if state is not None:
+        _parser_states[line] = _parser_states.pop(line)
+        return state[:2]
+
+    parser = Parser(0, 4)
+    parser.set_str(line + ' \n')
+    parser.set_checkpoint_limit(len(line))
+    # The most recent line this one extends is usually the previous
+    # keystroke's, which is also the longest.
+    isopener = []
+    for cached in reversed(_parser_states):
+        if line.startswith(cached):
+            bracketing, isopener, checkpoint = _parser_states[cached]
+            if checkpoint is not None:
+                parser.resume(checkpoint, bracketing)
+                isopener = isopener[:checkpoint[4]]
+            else:
+                isopener = []
+            break
+
+    bracketing = parser.get_last_stmt_bracketing()
+    # find which pairs of bracketing are openers. These always
+    # correspond to a character of rawtext.
+    if parser.resume_from is None:
+        isopener = []
+    isopener.extend(i > 0 and bracketing[i][1] > bracketing[i-1][1]
+                    for i in range(len(isopener), len(bracketing)))
+    _parser_states[line] = bracketing, isopener, parser.checkpoint
+    if len(_parser_states) > _parser_states_size:
+        _parser_states.popitem(last=False)
+    return bracketing, isopener
+
+
 class HyperParser(object):
     def __init__(self, line):
         """To initialize, analyze the surroundings of the given index."""
 
-        parser = Parser(0, 4)
-        parser.set_str(line + ' \n')
         self.rawtext = line
         self.stopatindex = len(line)
-        
-        self.bracketing = parser.get_last_stmt_bracketing()
-        # find which pairs of bracketing are openers. These always
-        # correspond to a character of rawtext.
-        self.isopener = [i > 0 and self.bracketing[i][1] >
-                         self.bracketing[i-1][1]
-                         for i in range(len(self.bracketing))]
+
+        self.bracketing, self.isopener = _line_bracketing(line)
 
         self.indexinrawtext = len(line)
         self.indexbracket = 0
@@ -787,6 +881,365 @@ class HyperParser(object):
         return rawtext[last_identifier_pos:self.indexinrawtext]
 
 
+# Sorted attribute names of recently completed objects, keyed by object
+# identity and type, so that completing the same object again doesn't call
+# dir() on it. Objects that can't be weakly referenced are kept alive by the
+# cache, so that their id isn't reused. Running code may add attributes, so
+# the extension clears the cache after every cell.
+_attribute_cache_size = 64
+_attribute_cache = OrderedDict()
+
+# Seconds to wait for the expression being completed, e.g. `load_data().`, to
+# evaluate. A slower evaluation goes on in the background and its value is
+# used by the next completions, while this one falls back to what can be
+# known without calling it. 0 waits for as long as it takes. Only expressions
+# with calls run in the background; the others, e.g. `conn.cursor`, are
+# evaluated in the calling thread.
+_eval_budget = float(os.environ.get("IPYTHON_SUGGESTIONS_EVAL_BUDGET", "0.5"))
+# Evaluations of the current completion session, which ends when a cell is
+# run, keyed by expression and namespace, and the compiled expressions.
+_evaluations = {}
+_code_cache_size = 256
+_code_cache = OrderedDict()
+
+
+# Sorted key reprs of recently completed mappings. The keys of mappings
+# larger than _key_index_max are searched for _key_search_budget seconds on
+# every completion instead. At most _key_completion_limit keys are offered.
+_key_indexes_size = 16
+_key_indexes = OrderedDict()
+_key_index_max = 200000
+_key_search_budget = 0.1
+_key_completion_limit = 1000
+
+
+# Names in recently completed directories, keyed by path and checked against
+# the directory's mtime. At most _file_completion_limit names are offered.
+_listing_cache_size = 16
+_listing_cache = OrderedDict()
+_file_completion_limit = 1000
+
+
+class EvaluationTimeout(Exception):
+    pass
+
+
+def clear_completion_caches(*args):
+    _attribute_cache.clear()
+    _key_indexes.clear()
+    _listing_cache.clear()
+    # An evaluation still running in the background is kept, so that it isn't
+    # started again until it ends, but its value is out of date.
+    for key, evaluation in list(_evaluations.items()):
+        if evaluation.done.is_set():
+            del _evaluations[key]
+        else:
+            evaluation.stale = True
+
+
+def _cache_get(cache, key, entity):
+    entry = cache.get(key)
+    if entry is not None and entry[0]() is entity:
+        cache[key] = cache.pop(key)
+        return entry[1]
+    return None
+
+
+def _cache_put(cache, size, key, entity, value):
+    try:
+        ref = weakref.ref(entity)
+    except TypeError:
+        ref = lambda: entity
+    cache[key] = ref, value
+    if len(cache) > size:
+        cache.popitem(last=False)
+
+
+def attribute_names(entity):
+    """Return the sorted unique names in `dir(entity)`."""
+    key = id(entity), type(entity)
+    names = _cache_get(_attribute_cache, key, entity)
+    if names is None:
+        names = sorted(set(dir(entity)))
+        _cache_put(_attribute_cache, _attribute_cache_size, key, entity, names)
+    return names
+
+
+def _key_reprs(keys):
+    for key in keys:
+        try:
+            r = repr(key)
+        except Exception:
+            continue
+        if not r.startswith('<'):
+            yield r
+
+
+def key_reprs(entity, prefix):
+    """Return the sorted reprs of the keys of `entity` that start with `prefix`.
+
+    At most `_key_completion_limit` reprs are returned. Mappings with up to
+    `_key_index_max` keys are indexed, keyed by identity and length, and the
+    keys of larger ones are searched one by one for `_key_search_budget`.
+    """
+    keys = entity.keys()
+    try:
+        n = len(keys)
+    except Exception:
+        n = None
+    if n is not None and n <= _key_index_max:
+        key = id(entity), type(entity), n
+        reprs = _cache_get(_key_indexes, key, entity)
+        if reprs is None:
+            reprs = sorted(set(_key_reprs(keys)))
+            _cache_put(_key_indexes, _key_indexes_size, key, entity, reprs)
+        return prefix_slice(reprs, prefix)[:_key_completion_limit]
+
+    matches = set()
+    deadline = time.time() + _key_search_budget
+    for count, r in enumerate(_key_reprs(keys)):
+        if r.startswith(prefix):
+            matches.add(r)
+            if len(matches) >= _key_completion_limit:
+                break
+        if count % 1000 == 999 and time.time() > deadline:
+            break
+    return sorted(matches)
+
+
+def prefix_slice(names, prefix):
+    """Return the names in the sorted list `names` that start with `prefix`."""
+    if not prefix:
+        return names
+    i = bisect.bisect_left(names, prefix)
+    j = bisect.bisect_left(names, prefix[:-1] + chr(ord(prefix[-1]) + 1), i)
+    return names[i:j]
+
+
+def directory_names(path):
+    """Return the names of the entries of the directory `path`."""
+    mtime = os.stat(path).st_mtime
+    entry = _listing_cache.get(path)
+    if entry is not None and entry[0] == mtime:
+        _listing_cache[path] = _listing_cache.pop(path)
+        return entry[1]
+
+    names = [e.name for e in os.scandir(path)]
+    _listing_cache[path] = mtime, names
+    if len(_listing_cache) > _listing_cache_size:
+        _listing_cache.popitem(last=False)
+    return names
+
+
+def _compile(source):
+    """Return the code of the expression `source`, and whether it has calls."""
+    entry = _code_cache.get(source)
+    if entry is None:
+        tree = ast.parse(source, "<completion>", "eval")
+        calls = any(isinstance(node, ast.Call) for node in ast.walk(tree))
+        entry = compile(tree, "<completion>", "eval"), calls
+        _code_cache[source] = entry
+        if len(_code_cache) > _code_cache_size:
+            _code_cache.popitem(last=False)
+    return entry
+
+
+class _Evaluation(object):
+    def __init__(self, code, namespace):
+        self.code = code
+        self.namespace = namespace
+        self.value = None
+        self.error = None
+        self.late = False
+        self.stale = False
+        self.threaded = False
+        self.done = threading.Event()
+
+    def run(self):
+        try:
+            self.value = eval(self.code, self.namespace)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+
+def _wrong_thread(error):
+    """Return whether `error` is sqlite3's refusal to use an object created
+    in another thread."""
+    return (
+        type(error).__module__ == "sqlite3"
+        and type(error).__name__ == "ProgrammingError"
+        and "created in a thread" in str(error)
+    )
+
+
+def evaluate(source, namespace):
+    """Return the value of the expression `source` in `namespace`.
+
+    The value is kept until the end of the completion session. Raises
+    EvaluationTimeout if an expression with calls takes longer than
+    `_eval_budget`, or is still being evaluated for an earlier session.
+    """
+    key = source, id(namespace)
+    evaluation = _evaluations.get(key)
+    if evaluation is None or evaluation.stale and evaluation.done.is_set():
+        code, calls = _compile(source)
+        evaluation = _Evaluation(code, namespace)
+        _evaluations[key] = evaluation
+        if calls and _eval_budget > 0:
+            evaluation.threaded = True
+            thread = threading.Thread(target=evaluation.run)
+            thread.daemon = True
+            thread.start()
+        else:
+            evaluation.run()
+    elif evaluation.stale:
+        raise EvaluationTimeout(source)
+
+    # Don't wait again for an evaluation that already ran out of time.
+    if not evaluation.done.wait(0 if evaluation.late else _eval_budget or None):
+        evaluation.late = True
+        raise EvaluationTimeout(source)
+    if evaluation.threaded and _wrong_thread(evaluation.error):
+        # sqlite3 refuses the call before making it, so it runs only once.
+        evaluation.threaded = False
+        evaluation.error = None
+        evaluation.run()
+    if evaluation.error is not None:
+        raise evaluation.error
+    return evaluation.value
+
+
+def static_value(source, namespace):
+    """Return a stand-in for the value of a call, without making the call.
+
+    For `f(...)`, where `f` is found without calls, this is `f` if it's a
+    class, whose instances have its attributes, or else its return annotation
+    if that is a class. Raises ValueError otherwise.
+    """
+    node = ast.parse(source, mode="eval").body
+    if (not isinstance(node, ast.Call) or
+            any(isinstance(n, ast.Call) for n in ast.walk(node.func))):
+        raise ValueError("not a simple call: %s" % source)
+    func = eval(compile(ast.Expression(node.func), "<completion>", "eval"), namespace)
+    if isinstance(func, type):
+        return func
+    annotation = getattr(func, "__annotations__", {}).get("return")
+    if isinstance(annotation, type):
+        return annotation
+    raise ValueError("unknown return type: %s" % source)
+
+
+class _CompletionRequest(object):
+    def __init__(self, hook, shell, event, key):
+        self.hook = hook
+        self.shell = shell
+        self.event = event
+        self.key = key
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class AsyncCompleter(object):
+    """Run completion hooks in a worker thread, and wait at most `deadline`
+    seconds for their completions.
+
+    Each hook has at most one pending request: a newer one replaces it
+    before it starts. A request for the same line as a running or finished
+    one waits for that one instead. When the deadline passes, the
+    completions of the last finished request for a shorter word on the same
+    line are returned, filtered by the word, and the late request keeps
+    running so that its completions are ready for the next request.
+    """
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.lock = threading.Condition()
+        self.pending = OrderedDict()
+        self.running = None
+        self.finished = {}
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def wrap(self, hook):
+        """Return a completion hook that runs `hook` in the worker thread."""
+        def complete(shell, event):
+            return self.complete(hook, shell, event)
+        complete.__name__ = hook.__name__
+        complete.__doc__ = hook.__doc__
+        return complete
+
+    def complete(self, hook, shell, event):
+        if self.stopped:
+            return hook(shell, event)
+        # Completions depend on the namespace, which changes with each cell.
+        key = (getattr(shell, "execution_count", None), event.line,
+               event.text_until_cursor, event.symbol)
+        with self.lock:
+            for request in (self.running, self.pending.get(hook),
+                            self.finished.get(hook)):
+                if request is not None and request.hook is hook and request.key == key:
+                    break
+            else:
+                request = _CompletionRequest(hook, shell, event, key)
+                self.pending.pop(hook, None)
+                self.pending[hook] = request
+                self.lock.notify()
+
+        if not request.done.wait(self.deadline):
+            return self.partial(hook, key)
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def partial(self, hook, key):
+        """Return the completions of the last finished request of `hook`
+        whose word is a prefix of the word of `key`, filtered by it."""
+        with self.lock:
+            request = self.finished.get(hook)
+        if request is None:
+            return []
+        count, line, curline, symbol = key
+        oldcount, oldline, oldcurline, oldsymbol = request.key
+        if (count != oldcount or not symbol.startswith(oldsymbol)
+                or curline[:len(curline) - len(symbol)]
+                != oldcurline[:len(oldcurline) - len(oldsymbol)]
+                or line[len(curline):] != oldline[len(oldcurline):]):
+            return []
+        return [c for c in request.result or () if c.startswith(symbol)]
+
+    def run(self):
+        while True:
+            with self.lock:
+                while not self.pending and not self.stopped:
+                    self.lock.wait()
+                if self.stopped:
+                    return
+                hook, request = self.pending.popitem(last=False)
+                self.running = request
+            try:
+                request.result = request.hook(request.shell, request.event)
+            except Exception as e:
+                request.error = e
+            with self.lock:
+                self.running = None
+                if request.error is None:
+                    self.finished[hook] = request
+            request.done.set()
+
+    def stop(self):
+        """Stop the worker thread, after that hooks run in the caller's thread."""
+        with self.lock:
+            self.stopped = True
+            self.pending.clear()
+            self.finished.clear()
+            self.lock.notify()
+
+
 # noinspection PyBroadException
 def super_greedy_complete(self, event, evalfuncs=True):
     curline = event.text_until_cursor
@@ -806,18 +1259,10 @@ def super_greedy_complete(self, event, evalfuncs=True):
             comp_what = ""
 
         try:
-            entity = eval(comp_what, self.user_ns)
-            keys = set()
-            for key in entity.keys():
-                try:
-                    r = repr(key)
-                    if not r.startswith('<'):
-                        if no_quote and r[-1] in '"\'':
-                            r = r[:-1]
-                        keys.add(r)
-                except Exception:
-                    pass
-            completions = sorted(keys)
+            entity = evaluate(comp_what, self.user_ns)
+            completions = key_reprs(entity, curline[i:])
+            if no_quote:
+                completions = [r[:-1] if r[-1] in '"\'' else r for r in completions]
         except Exception:
             pass
     # Filename in string.
@@ -829,22 +1274,17 @@ def super_greedy_complete(self, event, evalfuncs=True):
             i -= 1
         comp_what = curline[i:j]
 
-        if comp_what == "":
-            comp_what = "."
         try:
             from os.path import normcase
-            expandedpath = os.path.expanduser(comp_what)
-            bigl = os.listdir(expandedpath)
-            try:
-                cmp_ = cmp
-            except NameError:
-                def cmp_(x, y): return (x > y) - (x < y)
-            try:
-                completions = sorted(set(bigl), cmp=lambda x, y: cmp_(normcase(x), normcase(y)))
-            except TypeError:
-                # python 3...
-                import functools
-                completions = sorted(set(bigl), key=functools.cmp_to_key(lambda x, y: cmp_(normcase(x), normcase(y))))
+            expandedpath = os.path.expanduser(comp_what or ".")
+            prefix = curline[j:]
+            completions = [comp_what + name for name in directory_names(expandedpath)
+                           if name.startswith(prefix)]
+            if len(completions) > _file_completion_limit:
+                completions = heapq.nsmallest(_file_completion_limit, completions,
+                                              key=normcase)
+            else:
+                completions.sort(key=normcase)
         except OSError:
             pass
     # Name or attribute.
@@ -857,9 +1297,11 @@ def super_greedy_complete(self, event, evalfuncs=True):
 
             if comp_what and (evalfuncs or comp_what.find('(') == -1):
                 try:
-                    entity = eval(comp_what, self.user_ns)
-                    bigl = dir(entity)
-                    completions = sorted(set(bigl))
+                    try:
+                        entity = evaluate(comp_what, self.user_ns)
+                    except EvaluationTimeout:
+                        entity = static_value(comp_what, self.user_ns)
+                    completions = prefix_slice(attribute_names(entity), curline[i:])
                 except Exception:
                     pass
 
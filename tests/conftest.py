@@ -0,0 +1,28 @@
+import os
+import random
+import string
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def random_words(rng, count, alphabet="abcde_", maxlen=6):
+    return sorted(
+        set(
+            "".join(rng.choice(alphabet) for _ in range(rng.randint(1, maxlen)))
+            for _ in range(count)
+        )
+    )
+
+
+@pytest.fixture
+def words():
+    return random_words(random.Random(0), 400)
+
+
+@pytest.fixture
+def queries():
+    rng = random.Random(1)
+    return random_words(rng, 200) + random_words(rng, 50, string.ascii_lowercase)
@@ -0,0 +1,95 @@
+import threading
+import time
+
+import pytest
+
+from super_greedy_complete import AsyncCompleter
+
+
+class Event(object):
+    def __init__(self, line):
+        self.line = self.text_until_cursor = line
+        self.symbol = line.split()[-1]
+
+
+class Shell(object):
+    execution_count = 1
+
+
+class SlowHook(object):
+    """Completion hook that waits for `release` on the lines in `slow`."""
+
+    def __init__(self, names, slow=()):
+        self.names = names
+        self.slow = set(slow)
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.__name__ = self.__doc__ = "hook"
+
+    def __call__(self, shell, event):
+        self.calls.append(event.line)
+        if event.line in self.slow:
+            self.started.set()
+            assert self.release.wait(5)
+        return [name for name in self.names if name.startswith(event.symbol)]
+
+
+def wait_idle(completer):
+    deadline = time.time() + 5
+    while completer.pending or completer.running is not None:
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def completer():
+    completer = AsyncCompleter(0.05)
+    yield completer
+    completer.stop()
+
+
+def test_completes_in_time(completer):
+    hook = SlowHook(["foo", "fob", "bar"])
+    assert completer.complete(hook, Shell(), Event("x = fo")) == ["foo", "fob"]
+
+
+def test_superseded_requests_are_dropped(completer):
+    hook = SlowHook(["abcd"], slow=["x = a"])
+    assert completer.complete(hook, Shell(), Event("x = a")) == []
+    assert hook.started.wait(5)
+    # Both wait behind the running request, and the second replaces the first.
+    assert completer.complete(hook, Shell(), Event("x = ab")) == []
+    assert completer.complete(hook, Shell(), Event("x = abc")) == []
+    hook.release.set()
+    wait_idle(completer)
+    assert completer.complete(hook, Shell(), Event("x = abc")) == ["abcd"]
+    assert hook.calls == ["x = a", "x = abc"]
+
+
+def test_late_request_returns_partial_results(completer):
+    hook = SlowHook(["foo", "fob", "food"], slow=["x = foo"])
+    names = completer.complete(hook, Shell(), Event("x = fo"))
+    assert names == ["foo", "fob", "food"]
+    # The request for the longer word is late, so the previous completions
+    # are filtered by it meanwhile.
+    assert completer.complete(hook, Shell(), Event("x = foo")) == ["foo", "food"]
+    hook.release.set()
+    wait_idle(completer)
+    assert completer.complete(hook, Shell(), Event("x = foo")) == ["foo", "food"]
+    assert hook.calls == ["x = fo", "x = foo"]
+
+
+def test_no_partial_results_for_another_line(completer):
+    hook = SlowHook(["foo", "bar"], slow=["y = fo"])
+    completer.complete(hook, Shell(), Event("x = fo"))
+    assert completer.complete(hook, Shell(), Event("y = fo")) == []
+    hook.release.set()
+
+
+def test_stopped_completer_runs_hooks_directly(completer):
+    completer.stop()
+    hook = SlowHook(["foo"])
+    assert completer.complete(hook, Shell(), Event("x = f")) == ["foo"]
+    completer.thread.join(5)
+    assert not completer.thread.is_alive()
@@ -0,0 +1,101 @@
+import os
+import sys
+
+import pytest
+
+import ipython_suggestions
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    """A sys.path of one shared directory and the working directory."""
+    site = tmp_path / "site"
+    site.mkdir()
+    (site / "shared_mod.py").write_text("def shared_func():\n    pass\n")
+    work = tmp_path / "work"
+    work.mkdir()
+    (work / "local_mod.py").write_text("LOCAL_VALUE = 1\n")
+    monkeypatch.chdir(work)
+    monkeypatch.setattr(sys, "path", [str(site), ""])
+    monkeypatch.setattr(ipython_suggestions, "_cache_dir", str(tmp_path / "cache"))
+    monkeypatch.setattr(ipython_suggestions, "_scan_workers", 1)
+    monkeypatch.setattr(ipython_suggestions, "_history_file", None)
+    return site, work
+
+
+def scan():
+    symbols, local, _, stats = ipython_suggestions._scan()
+    return symbols, local, stats
+
+
+def parsed(stats, local):
+    return sum(root["parsed"] for root in stats["roots"] if root["local"] == local)
+
+
+def test_reused_index_does_not_load_shared_table_cache(env, monkeypatch):
+    site, work = env
+    symbols, local, stats = scan()
+    assert "shared_func" in symbols
+    assert parsed(stats, False) == 1 and parsed(stats, True) == 1
+
+    loaded = []
+    load = ipython_suggestions._load_file_cache
+
+    def spy(ext=".pickle"):
+        loaded.append(ext)
+        return load(ext)
+
+    monkeypatch.setattr(ipython_suggestions, "_load_file_cache", spy)
+    symbols, local, stats = scan()
+    assert stats["reused_index"]
+    assert loaded == [".local"]
+    assert parsed(stats, False) == parsed(stats, True) == 0
+    assert [name for name, _, _ in local.values()] == ["local_mod"]
+
+    # A changed file of the working directory is parsed again, alone.
+    (work / "local_mod.py").write_text("LOCAL_VALUE = 1\nOTHER_VALUE = 2\n")
+    os.utime(str(work / "local_mod.py"), ns=(0, 0))
+    symbols, local, stats = scan()
+    assert stats["reused_index"] and parsed(stats, True) == 1
+    (_, _, tables), = local.values()
+    assert [sym for _, sym, _ in tables] == ["LOCAL_VALUE", "OTHER_VALUE"]
+
+
+def test_working_directory_is_kept_out_of_shared_caches(env, tmp_path):
+    scan()
+    files = ipython_suggestions._load_file_cache()
+    assert str(env[0] / "shared_mod.py") in files
+    assert not any(path.startswith(str(env[1])) for path in files)
+    assert list(ipython_suggestions._load_file_cache(".local")) == [
+        str(env[1] / "local_mod.py")
+    ]
+
+
+def test_only_changed_files_are_parsed_again(env):
+    site, work = env
+    (site / "other_mod.py").write_text("OTHER = 1\n")
+    symbols, local, stats = scan()
+    assert parsed(stats, False) == 2
+
+    (site / "shared_mod.py").write_text("def renamed_func():\n    pass\n")
+    symbols, local, stats = scan()
+    assert not stats["reused_index"]
+    assert parsed(stats, False) == 1
+    assert "renamed_func" in symbols and "shared_func" not in symbols
+    assert "OTHER" in symbols
+    files = ipython_suggestions._load_file_cache()
+    tables = files[str(site / "shared_mod.py")][2]
+    assert [sym for _, sym, _ in tables] == ["renamed_func"]
+
+
+def test_removed_files_are_dropped_from_the_cache(env):
+    site, work = env
+    (site / "other_mod.py").write_text("OTHER = 1\n")
+    scan()
+    (site / "other_mod.py").unlink()
+    symbols, local, stats = scan()
+    assert parsed(stats, False) == 0
+    assert "OTHER" not in symbols and "shared_func" in symbols
+    assert list(ipython_suggestions._load_file_cache()) == [
+        str(site / "shared_mod.py")
+    ]
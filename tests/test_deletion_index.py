@@ -0,0 +1,47 @@
+import pytest
+
+from ipython_suggestions import (
+    DeletionIndex,
+    SymbolStore,
+    _deletion_tables,
+    close_words,
+)
+
+
+def build_store(words):
+    objs = dict(
+        (word, {("var", "pkg.mod%d" % (i % 7)): ("/src/mod%d.py" % (i % 7), i)})
+        for i, word in enumerate(words)
+    )
+    return SymbolStore(objs)
+
+
+def test_deletion_index_finds_close_words(words, queries):
+    index = DeletionIndex(words)
+    all_words = set(words)
+    for word in queries:
+        assert set(index.close_words(word)) == set(close_words(word, all_words))
+
+
+def test_hashed_deletion_index_finds_close_words(words, queries):
+    index = build_store(words).deletion_index()
+    all_words = set(words)
+    for word in queries:
+        assert set(index.close_words(word)) == set(close_words(word, all_words))
+
+
+def test_hashed_deletion_index_is_read_only(words):
+    index = build_store(words).deletion_index()
+    with pytest.raises(TypeError):
+        index.add("new")
+
+
+def test_deletion_tables_are_sorted_in_buckets(words):
+    deletes, buckets = _deletion_tables(words)
+    assert list(deletes) == sorted(deletes)
+    assert len(deletes) == sum(
+        len(set(w[:i] + w[i + 1 :] for i in range(len(w)))) for w in words
+    )
+    assert len(buckets) == 0x10001 and buckets[-1] == len(deletes)
+    for b in set(x >> 48 for x in deletes):
+        assert all(x >> 48 == b for x in deletes[buckets[b] : buckets[b + 1]])
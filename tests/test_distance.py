@@ -0,0 +1,18 @@
+import pytest
+
+from ipython_suggestions import close_distance_words, osa_distance
+
+
+@pytest.mark.parametrize("maxdist", [1, 2, 3])
+def test_close_distance_words(words, queries, maxdist):
+    for word in queries:
+        expected = [w for w in words if osa_distance(word, w) <= maxdist]
+        assert list(close_distance_words(word, maxdist, words)) == expected
+
+
+def test_osa_distance():
+    assert osa_distance("", "abc") == 3
+    assert osa_distance("abc", "abc") == 0
+    assert osa_distance("abc", "acb") == 1
+    assert osa_distance("ca", "abc") == 3
+    assert osa_distance("kitten", "sitting") == 3
@@ -0,0 +1,81 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import super_greedy_complete
+from super_greedy_complete import EvaluationTimeout, evaluate
+
+
+@pytest.fixture(autouse=True)
+def fresh_evaluations(monkeypatch):
+    monkeypatch.setattr(super_greedy_complete, "_evaluations", {})
+
+
+def test_evaluate_without_calls_in_calling_thread():
+    conn = sqlite3.connect(":memory:")
+    local = threading.local()
+    local.obj = conn
+    namespace = {"conn": conn, "local": local}
+    assert evaluate("conn", namespace) is conn
+    assert evaluate("local.obj", namespace) is conn
+
+
+def test_evaluate_retries_calls_sqlite3_refuses():
+    conn = sqlite3.connect(":memory:")
+    namespace = {"conn": conn}
+    assert isinstance(evaluate("conn.cursor()", namespace), sqlite3.Cursor)
+    rows = evaluate("conn.execute('select 1').fetchall()", namespace)
+    assert rows == [(1,)]
+
+
+def test_late_evaluation_is_not_restarted(monkeypatch):
+    monkeypatch.setattr(super_greedy_complete, "_eval_budget", 0.05)
+    calls = []
+    release = threading.Event()
+
+    def slow():
+        calls.append(1)
+        release.wait(5)
+        return 42
+
+    namespace = {"slow": slow}
+    with pytest.raises(EvaluationTimeout):
+        evaluate("slow()", namespace)
+    super_greedy_complete.clear_completion_caches()
+    with pytest.raises(EvaluationTimeout):
+        evaluate("slow()", namespace)
+    assert len(calls) == 1
+
+    release.set()
+    evaluation = super_greedy_complete._evaluations["slow()", id(namespace)]
+    assert evaluation.done.wait(5)
+    # The late value belongs to an earlier session, so it is evaluated again.
+    assert evaluate("slow()", namespace) == 42
+    assert len(calls) == 2
+
+
+def test_failed_call_is_not_made_again():
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise ValueError("no")
+
+    with pytest.raises(ValueError):
+        evaluate("fail()", {"fail": fail})
+    assert len(calls) == 1
+
+
+def test_failed_call_within_budget(monkeypatch):
+    monkeypatch.setattr(super_greedy_complete, "_eval_budget", 0.5)
+
+    def fail():
+        time.sleep(0.2)
+        raise ValueError("no")
+
+    start = time.perf_counter()
+    with pytest.raises(ValueError):
+        evaluate("fail()", {"fail": fail})
+    assert time.perf_counter() - start < 0.4
@@ -0,0 +1,106 @@
+import os
+import random
+import types
+
+import pytest
+
+import ipython_suggestions
+from ipython_suggestions import SymbolStore, close_cached_symbol, suggest_prefix
+
+STDLIB = ipython_suggestions._stdlib_dirs[0]
+SITE = os.path.join(os.sep, "env", "site-packages", "")
+
+
+def publish(monkeypatch, store):
+    monkeypatch.setattr(ipython_suggestions, "_symbols", store)
+    monkeypatch.setattr(
+        ipython_suggestions, "_symbols_deletes", store.deletion_index()
+    )
+    monkeypatch.setattr(ipython_suggestions, "_symbols_overlay", None)
+
+
+@pytest.fixture
+def widgets(monkeypatch):
+    objs = {
+        "Widget": {
+            ("class", "gadgets"): (SITE + "gadgets.py", 1),
+            ("class", "tools.deep.impl"): (SITE + "tools/deep/impl.py", 1),
+            ("class", "tools.impl"): (SITE + "tools/impl.py", 1),
+            ("var", "tools"): (SITE + "tools/__init__.py", 1),
+            ("class", "_private"): (SITE + "_private.py", 1),
+            ("class", "stdmod"): (STDLIB + "stdmod.py", 1),
+        },
+        "Widgit": {("class", "gadgets"): (SITE + "gadgets.py", 2)},
+    }
+    popularity = {("gadgets", "Widget"): 5, ("_private", "Widget"): 9}
+    publish(monkeypatch, SymbolStore(objs, popularity))
+
+
+def codes(*args, **kwargs):
+    return [code for _, code in close_cached_symbol(*args, **kwargs)]
+
+
+def test_findsymbol_ranking(widgets):
+    assert codes("Widget", False, 1) == [
+        # Most imported first,
+        "from gadgets import Widget",
+        # then the standard library,
+        "from stdmod import Widget",
+        # then shallow modules before deep ones,
+        "from tools.impl import Widget",
+        "from tools.deep.impl import Widget",
+        # then variables after classes,
+        "from tools import Widget",
+        # then private modules, however popular,
+        "from _private import Widget",
+        # then the names further away.
+        "from gadgets import Widgit",
+    ]
+
+
+def test_findsymbol_pages(widgets):
+    everything = codes("Widget", False, 1)
+    for limit in range(1, len(everything) + 1):
+        pages = []
+        offset = 0
+        while True:
+            page = codes("Widget", False, 1, limit, offset)
+            assert len(page) <= limit
+            if not page:
+                break
+            pages += page
+            offset += limit
+        assert pages == everything
+    assert codes("Widget", False, 1, 3, len(everything)) == []
+
+
+def test_ranked_prefix_limit_matches_full_ranking(words, tmp_path):
+    rng = random.Random(2)
+    objs = {}
+    popularity = {}
+    for word in words:
+        for _ in range(rng.randint(1, 4)):
+            modulepath = rng.choice(["a", "a.b", "_c", "a.tests.d", "e.f.g"])
+            filepath = "/src/%s.py" % modulepath
+            objs.setdefault(word, {})[("def", modulepath)] = (filepath, 1)
+            if rng.random() < 0.3:
+                popularity[(modulepath, word)] = rng.randint(1, 20)
+    store = SymbolStore(objs, popularity)
+    path = str(tmp_path / "symbols.index")
+    store.save(path, b"0" * 20)
+    for symbols in (store, SymbolStore.open(path)):
+        for key in ["a", "b", "_", "ab", "c_", "e"]:
+            full = symbols.ranked_prefix(key, 0)
+            assert [rank for rank, _, _ in full] == sorted(r for r, _, _ in full)
+            for limit in (1, 3, 10):
+                assert symbols.ranked_prefix(key, limit) == full[:limit]
+            # The records of a file that changed since the index was built.
+            hidden = frozenset([list(symbols.files).index("/src/a.b.py")])
+            shown = [record for record in full if record[2] != "a.b"]
+            assert symbols.ranked_prefix(key, 5, hidden) == shown[:5]
+
+
+def test_prefix_completions(widgets, monkeypatch):
+    monkeypatch.setattr(ipython_suggestions, "_completion_limit", 2)
+    event = types.SimpleNamespace(symbol="Widg")
+    assert suggest_prefix(None, event) == ["Widget...gadgets", "Widget...stdmod"]
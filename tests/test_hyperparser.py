@@ -0,0 +1,55 @@
+from collections import OrderedDict
+
+import pytest
+
+import super_greedy_complete
+from super_greedy_complete import HyperParser
+
+LINES = [
+    "x = foo.bar(baz[1], 'a b').qux",
+    'd["key"][u"other"].value',
+    "print(a, (b + c) * [d, {e: f}]).attr  # comment (",
+    "s = 'it''s' + \"str\\\"ing\" + os.path.join('a', 'b').up",
+    "lambda x: x[0] if x else {}.get(",
+    "f(a)(b)[c]{d}.e",
+    "'''unterminated",
+    "x = [i for i in range(10) if i % 2].",
+    "\tif (a and\\",
+]
+
+
+def analyze(line):
+    hp = HyperParser(line)
+    return (
+        hp.bracketing,
+        hp.isopener,
+        hp.is_in_string(),
+        hp.is_in_code(),
+        hp.is_in_dict(),
+        hp.get_expression() if hp.is_in_code() or hp.is_in_dict() else None,
+    )
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches(monkeypatch):
+    monkeypatch.setattr(super_greedy_complete, "_parser_states", OrderedDict())
+
+
+@pytest.mark.parametrize("line", LINES)
+def test_hyperparser_resume_matches_fresh_parse(monkeypatch, line):
+    # Typing the line keystroke by keystroke resumes the previous parse.
+    resumed = [analyze(line[:i]) for i in range(1, len(line) + 1)]
+    fresh = []
+    for i in range(1, len(line) + 1):
+        monkeypatch.setattr(super_greedy_complete, "_parser_states", OrderedDict())
+        fresh.append(analyze(line[:i]))
+    assert resumed == fresh
+
+
+def test_hyperparser_resume_after_edit(monkeypatch):
+    for line in ["foo(bar", "foo(bar)", "foo(ba", "foo(bar[", "foo(bar['x"]:
+        resumed = analyze(line)
+        states = super_greedy_complete._parser_states
+        monkeypatch.setattr(super_greedy_complete, "_parser_states", OrderedDict())
+        assert resumed == analyze(line)
+        monkeypatch.setattr(super_greedy_complete, "_parser_states", states)
@@ -0,0 +1,84 @@
+import io
+import re
+
+import pytest
+
+from ipython_suggestions import _scan_file
+
+# The per-line matchers that _scan_file replaced, which read files in text
+# mode. Their results are the reference for files they could decode.
+defclass = re.compile(r"(class|def) ([_A-z][_A-z0-9]*)[\(:]")
+variable = re.compile(r"([A-z][_A-z0-9]+)\s=")
+
+
+def scan_lines(data):
+    symbols = []
+    f = io.TextIOWrapper(io.BytesIO(data), encoding="latin-1", newline=None)
+    for i, line in enumerate(f):
+        m = defclass.match(line)
+        if m:
+            t, sym = m.groups()
+            symbols.append((t, sym, i))
+        else:
+            m = variable.match(line)
+            if m:
+                symbols.append(("var", m.group(1), i))
+    return symbols
+
+
+SOURCES = {
+    "lf": b"import os\n\nclass Foo(object):\n    def bar(self):\n        pass\n\n"
+    b"def baz():\n    pass\n\nQUX = 1\n",
+    "crlf": b"class Foo:\r\n    pass\r\n\r\ndef bar(x):\r\n    return x\r\nBAZ = 2\r\n",
+    "lone_cr": b"class Foo:\r    pass\rdef bar():\r    pass\rBAZ = 3\r",
+    "mixed_endings": b"A1 = 1\r\nB2 = 2\rC3 = 3\nD4 = 4\n\r\nE5 = 5",
+    "comparison": b"x == 1\nyy == 2\nzz = 3\nww =4\nvv=5\n",
+    "tab_before_equals": b"ab\t= 1\ncd \t = 2\nef\t\t=3\n",
+    "indented_defs": b"if True:\n    def inner():\n        pass\n    class Inner:\n"
+    b"        pass\n\tTABBED = 1\ndef outer(): pass\n",
+    "no_trailing_newline": b"def last(): pass",
+    "keywords_and_prefixes": b"classy = 1\ndefault = 2\nclass(x)\ndef:\n"
+    b"async def f():\n",
+    "empty": b"",
+}
+
+
+@pytest.mark.parametrize("name", sorted(SOURCES))
+def test_scan_file_matches_per_line_matchers(tmp_path, name):
+    path = tmp_path / "module.py"
+    path.write_bytes(SOURCES[name])
+    symbols, _ = _scan_file(str(path))
+    assert symbols == scan_lines(SOURCES[name])
+
+
+def test_scan_file_skips_undecodable_bytes(tmp_path):
+    # The text mode matchers stopped at the first chunk that wasn't UTF-8.
+    data = (
+        b"FIRST = 1\nname = '\xff\xfe'\n# caf\xe9\n"
+        b"class Later:\n    pass\nLAST = 2\n"
+    )
+    path = tmp_path / "latin1.py"
+    path.write_bytes(data)
+    symbols, _ = _scan_file(str(path))
+    assert symbols == scan_lines(data)
+    assert ("class", "Later", 3) in symbols
+    assert ("var", "LAST", 5) in symbols
+
+
+def test_scan_file_imports(tmp_path):
+    path = tmp_path / "imports.py"
+    path.write_bytes(
+        b"import os.path\r\nfrom collections import (OrderedDict,\r\n    deque)\r\n"
+        b"from . import sibling\r\n"
+    )
+    _, imports = _scan_file(str(path))
+    assert set(imports) >= {
+        ("os", "path"),
+        ("collections", "OrderedDict"),
+        ("collections", "deque"),
+    }
+    assert not any(name == "sibling" for _, name in imports)
+
+
+def test_scan_missing_file(tmp_path):
+    assert _scan_file(str(tmp_path / "missing.py")) == ([], ())
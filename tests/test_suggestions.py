@@ -0,0 +1,46 @@
+import types
+
+import ipython_suggestions
+from ipython_suggestions import NamespaceIndex, close_attributes
+from super_greedy_complete import attribute_names
+
+
+def test_close_attributes_sees_attributes_added_after_completion():
+    module = types.ModuleType("m")
+    # Completing `m.` caches the listing of the module.
+    assert "abcdefgh" not in attribute_names(module)
+    setattr(module, "abcdefgh", 1)
+    assert list(close_attributes(module, "abcdefgx")) == ["abcdefgh"]
+
+
+def test_close_attributes_of_instances():
+    class Thing(object):
+        def method_one(self):
+            pass
+
+    thing = Thing()
+    thing.field_one = 1
+    assert set(close_attributes(thing, "method_on")) == {"method_one"}
+    assert set(close_attributes(thing, "field_onr")) == {"field_one"}
+
+
+def test_namespace_index_update():
+    namespace = {"alpha": 1, "beta": 2}
+    index = NamespaceIndex(namespace)
+    namespace["gamma"] = 3
+    del namespace["alpha"]
+    namespace[1] = "not a name"
+    index.update()
+    assert set(index.words) == {"beta", "gamma"}
+    assert list(index.close_words("gamme")) == ["gamma"]
+    assert list(index.close_words("alpa")) == []
+
+
+def test_namespace_index_sees_names_defined_since_the_last_error(monkeypatch):
+    monkeypatch.setattr(ipython_suggestions, "_user_ns_index", None)
+    namespace = {"first_value": 1}
+    index = ipython_suggestions._namespace_index(namespace)
+    namespace["second_value"] = 2
+    assert ipython_suggestions._namespace_index(namespace) is index
+    assert list(index.close_words("second_valeu")) == ["second_value"]
+    assert ipython_suggestions._namespace_index({}) is not index
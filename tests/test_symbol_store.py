@@ -0,0 +1,61 @@
+import pytest
+
+from ipython_suggestions import SymbolStore, close_distance_words, close_trie_words
+
+
+def test_symbol_store_mmap_round_trip(tmp_path, words, queries):
+    objs = {
+        "OrderedDict": {
+            ("class", "collections"): ("/lib/collections/__init__.py", 10),
+            ("var", "typing"): ("/lib/typing.py", 20),
+        },
+        "_private": {("def", "pkg._impl"): ("/src/pkg/_impl.py", 3)},
+    }
+    for i, word in enumerate(words):
+        objs.setdefault(word, {})[("def", "pkg.mod%d" % (i % 5))] = (
+            "/src/pkg/mod%d.py" % (i % 5),
+            i,
+        )
+    popularity = {("collections", "OrderedDict"): 7, ("pkg.mod1", words[1]): 2}
+    store = SymbolStore(objs, popularity)
+    path = str(tmp_path / "symbols.index")
+    digest = b"0123456789abcdefghij"
+    store.save(path, digest)
+    mapped = SymbolStore.open(path)
+
+    assert mapped.mapped and not store.mapped
+    assert mapped.digest == digest
+    assert list(mapped.names) == store.names
+    assert list(mapped.modules) == store.modules
+    assert list(mapped.files) == store.files
+    for part in ("starts", "kind_codes", "module_ids", "file_ids", "lines"):
+        assert list(getattr(mapped, part)) == list(getattr(store, part))
+    assert list(mapped.popularity) == list(store.popularity)
+    assert list(mapped.ranks) == list(store.ranks)
+    assert mapped.import_counts() == store.import_counts()
+    assert list(mapped.lookup("OrderedDict")) == list(store.lookup("OrderedDict"))
+    for key in ("O", "_", "a", "ab", "zz"):
+        for limit in (0, 1, 5):
+            assert mapped.ranked_prefix(key, limit) == store.ranked_prefix(key, limit)
+
+    assert [list(table) for table in mapped.name_trie()] == [
+        list(table) for table in store.name_trie()
+    ]
+    for word in ["OrderdDict", "_privat", "abc"]:
+        assert list(
+            close_trie_words(word, 2, mapped.name_trie(), mapped.names)
+        ) == list(close_distance_words(word, 2, store.names))
+
+    mapped_deletes = mapped.deletion_index()
+    deletes = store.deletion_index()
+    for word in queries + ["OrderdDict"]:
+        assert sorted(mapped_deletes.close_words(word)) == sorted(
+            deletes.close_words(word)
+        )
+
+
+def test_symbol_store_open_rejects_other_files(tmp_path):
+    path = tmp_path / "other.index"
+    path.write_bytes(b"\0" * 4096)
+    with pytest.raises(ValueError):
+        SymbolStore.open(str(path))
@@ -0,0 +1,96 @@
+import sys
+import time
+import types
+from threading import Thread
+
+import pytest
+
+import ipython_suggestions
+from ipython_suggestions import SymbolStore, close_cached_symbol, suggest_prefix
+
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    """An index of a sys.path entry holding `mod_a` and the package `pkg`."""
+    site = tmp_path / "site"
+    (site / "pkg").mkdir(parents=True)
+    mod_a = str(site / "mod_a.py")
+    inner = str(site / "pkg" / "inner.py")
+    (site / "mod_a.py").write_text("def old_func():\n    pass\n")
+    (site / "pkg" / "inner.py").write_text("INNER = 1\n")
+    objs = {
+        "mod_a": {("module", ""): (mod_a, 0)},
+        "old_func": {("def", "mod_a"): (mod_a, 1)},
+        "inner": {("module", "pkg"): (inner, 0)},
+        "INNER": {("var", "pkg.inner"): (inner, 1)},
+    }
+    symbols = SymbolStore(objs)
+    monkeypatch.setattr(ipython_suggestions, "_symbols", symbols)
+    monkeypatch.setattr(
+        ipython_suggestions, "_symbols_deletes", symbols.deletion_index()
+    )
+    monkeypatch.setattr(ipython_suggestions, "_symbols_overlay", None)
+    return site
+
+
+def codes(word, exact=True, maxdist=None):
+    return [code for _, code in close_cached_symbol(word, exact, maxdist)]
+
+
+def prefixed(key):
+    return suggest_prefix(None, types.SimpleNamespace(symbol=key))
+
+
+def test_changed_and_new_files_replace_their_records(site):
+    (site / "mod_a.py").write_text("def new_func():\n    pass\n")
+    (site / "mod_b.py").write_text("class Fresh(object):\n    pass\n")
+    ipython_suggestions._apply_changes(
+        {str(site / "mod_a.py"): str(site), str(site / "mod_b.py"): str(site)}, set()
+    )
+    assert codes("old_func") == []
+    assert codes("new_func") == ["from mod_a import new_func"]
+    assert codes("Fresh") == ["from mod_b import Fresh"]
+    assert codes("new_fucn", False) == ["from mod_a import new_func"]
+    assert codes("new_fnc", False, 1) == ["from mod_a import new_func"]
+    assert codes("INNER") == ["from pkg.inner import INNER"]
+    assert prefixed("new") == ["new_func...mod_a"]
+    assert prefixed("old") == []
+
+    # Later batches keep the changes of the earlier ones.
+    (site / "mod_b.py").unlink()
+    ipython_suggestions._apply_changes({str(site / "mod_b.py"): str(site)}, set())
+    assert codes("Fresh") == []
+    assert codes("new_func") == ["from mod_a import new_func"]
+
+
+def test_removed_directories_hide_their_files(site):
+    ipython_suggestions._apply_changes({}, {str(site / "pkg")})
+    assert codes("INNER") == []
+    assert codes("old_func") == ["from mod_a import old_func"]
+
+
+def test_overlay_of_another_index_is_ignored(site, monkeypatch):
+    (site / "mod_a.py").write_text("def new_func():\n    pass\n")
+    ipython_suggestions._apply_changes({str(site / "mod_a.py"): str(site)}, set())
+    # A rescan published a new index, which already has the change.
+    monkeypatch.setattr(ipython_suggestions, "_symbols", SymbolStore({}))
+    assert codes("new_func") == []
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify")
+def test_inotify_watcher_applies_changes(site, monkeypatch):
+    monkeypatch.setattr(ipython_suggestions, "_watch_delay", 0.05)
+    watcher = ipython_suggestions._InotifyWatcher({str(site): str(site)})
+    thread = Thread(target=watcher.run)
+    thread.daemon = True
+    thread.start()
+    try:
+        (site / "mod_b.py").write_text("class Fresh(object):\n    pass\n")
+        deadline = time.time() + 5
+        while not codes("Fresh") and time.time() < deadline:
+            time.sleep(0.02)
+        assert codes("Fresh") == ["from mod_b import Fresh"]
+    finally:
+        watcher.stop()
+        thread.join(5)
+    assert not thread.is_alive()